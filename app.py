@@ -1,12 +1,49 @@
-from flask import Flask, render_template, redirect, url_for, request, jsonify, make_response, session
+from flask import Flask, render_template, redirect, url_for, request, jsonify, make_response, session, Response
 import secrets
 import json
-from hydraulics.diagram_handler import run_solver
+import os
+from hydraulics.diagram_handler import run_solver_cached
+from hydraulics.cache import ResultCache, ObjectCache
+from hydraulics.results import DeltaEncoder
+from hydraulics.sweep import run_sweep
+from hydraulics.sensitivity import run_sensitivity
+from hydraulics.scenario import run_scenario
+from hydraulics import metrics as solverMetrics
+from hydraulics.jobs import JobQueue
+from hydraulics.live import run_live
+from session_store import ServerSessionInterface, create_session_store
 
 app = Flask(__name__)
 app.debug = False
 app.testing = False
 app.secret_key = secrets.token_urlsafe(16)
+app.session_interface = ServerSessionInterface(
+    create_session_store(os.environ.get('HYDRUI_SESSION_STORE', 'memory'),
+                         ttl=float(os.environ.get('HYDRUI_SESSION_TTL', 86400))))
+
+resultCache = ResultCache(maxEntries=int(os.environ.get('HYDRUI_CACHE_ENTRIES', 256)),
+                          maxBytes=int(os.environ.get('HYDRUI_CACHE_BYTES', 64 * 2**20)),
+                          ttl=float(os.environ.get('HYDRUI_CACHE_TTL', 600)))
+warmStarts = ResultCache(maxEntries=int(os.environ.get('HYDRUI_WARM_START_ENTRIES', 1024)),
+                         ttl=float(os.environ.get('HYDRUI_WARM_START_TTL', 3600)))
+jobQueue = JobQueue(maxWorkers=int(os.environ.get('HYDRUI_JOB_WORKERS', 0)) or None,
+                    timeout=float(os.environ.get('HYDRUI_JOB_TIMEOUT', 60)),
+                    cache=resultCache)
+liveSessions = ObjectCache(maxEntries=int(os.environ.get('HYDRUI_LIVE_SESSIONS', 64)),
+                           ttl=float(os.environ.get('HYDRUI_LIVE_TTL', 1800)))
+sweepWorkers = int(os.environ.get('HYDRUI_SWEEP_WORKERS', 0)) or os.cpu_count() or 1
+reduceNetwork = os.environ.get('HYDRUI_REDUCE_NETWORK', '0').lower() in ('1', 'true', 'yes')
+deltaEncoders = ObjectCache(maxEntries=int(os.environ.get('HYDRUI_DELTA_SESSIONS', 1024)),
+                            ttl=float(os.environ.get('HYDRUI_DELTA_TTL', 1800)))
+
+
+def result_options(args):
+    resultFormat = args.get('format', 'text')
+    delta = str(args.get('delta', '')).lower() in ('1', 'true', 'yes')
+    tol = float(args.get('tol', 1e-4))
+    if resultFormat not in ('text', 'numeric') or (delta and resultFormat != 'numeric'):
+        raise ValueError("Use format 'text' or 'numeric'. Delta results need the numeric format.")
+    return resultFormat, delta, tol
 
 
 @app.route('/')
@@ -24,15 +61,28 @@ def draw():
 @app.route('/solve', methods=['GET', 'POST'])
 def solve():
     if request.method == 'POST':
+        try:
+            resultFormat, delta, tol = result_options(request.args)
+        except ValueError as e:
+            return make_response(jsonify({'status': 'error', 'message': str(e)}), 400)
         try:
             diagram = request.get_json(silent=True)
             session['diagram'] = diagram
-            status, message, result = run_solver(diagram)
+            clientId = session.setdefault('clientId', secrets.token_urlsafe(16))
+            status, message, result, metrics = run_solver_cached(diagram, resultCache, warmStarts, clientId,
+                                                                 resultFormat, reduceNetwork)
             session['status'] = status
             session['result'] = result
+            if delta and status != 'fail':
+                encoder = deltaEncoders.get(clientId)
+                if encoder is None:
+                    encoder = DeltaEncoder()
+                    deltaEncoders.put(clientId, encoder)
+                result = encoder.encode(result, tol, request.args.get('base', type=int))
             return jsonify({'status': status,
                             'message': message,
-                            'result': result})
+                            'result': result,
+                            'metrics': metrics})
         except json.JSONDecodeError:
             status = 'error'
             session['diagram'] = None
@@ -44,5 +94,132 @@ def solve():
                         'diagram': session.get('diagram'),
                         'result': session.get('result')})
 
+@app.route('/solve/live', methods=['POST', 'DELETE'])
+def solve_live():
+    clientId = session.setdefault('clientId', secrets.token_urlsafe(16))
+    if request.method == 'DELETE':
+        return jsonify({'removed': liveSessions.drop(clientId)})
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('diagram', data.get('diff', {})), dict):
+        return make_response(jsonify({'status': 'error', 'message': 'Invalid JSON'}), 400)
+    try:
+        resultFormat, delta, tol = result_options(data)
+    except ValueError as e:
+        return make_response(jsonify({'status': 'error', 'message': str(e)}), 400)
+    status, message, result, metrics = run_live(liveSessions, clientId, diagramData=data.get('diagram'),
+                                                diff=data.get('diff'), version=data.get('version'),
+                                                seq=data.get('seq'), resultFormat=resultFormat, delta=delta,
+                                                tol=tol, deltaBase=data.get('base'))
+    session['status'] = status
+    response = jsonify({'status': status,
+                        'message': message,
+                        'result': result,
+                        'metrics': metrics,
+                        'version': metrics.get('version'),
+                        'seq': data.get('seq')})
+    return make_response(response, 409) if status == 'resync' else response
+
+@app.route('/solve/cache', methods=['GET', 'DELETE'])
+def solve_cache():
+    if request.method == 'DELETE':
+        removed = resultCache.invalidate(request.args.get('key'))
+        return jsonify({'removed': removed, **resultCache.stats()})
+    else:
+        return jsonify(resultCache.stats())
+
+@app.route('/jobs', methods=['GET', 'POST'])
+def jobs():
+    if request.method == 'POST':
+        diagram = request.get_json(silent=True)
+        if not isinstance(diagram, dict):
+            return make_response(jsonify({'status': 'error', 'message': 'Invalid JSON'}), 400)
+        try:
+            job = jobQueue.submit(diagram)
+        except Exception as e:
+            return make_response(jsonify({'status': 'error', 'message': str(e)}), 503)
+        return make_response(jsonify(job.to_dict()), 202)
+    else:
+        return jsonify(jobQueue.stats())
+
+@app.route('/jobs/<jobId>', methods=['GET', 'DELETE'])
+def job(jobId):
+    job = jobQueue.cancel(jobId) if request.method == 'DELETE' else jobQueue.get(jobId)
+    if job is None:
+        return make_response(jsonify({'status': 'error', 'message': 'Unknown job'}), 404)
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<jobId>/events')
+def job_events(jobId):
+    job = jobQueue.get(jobId)
+    if job is None:
+        return make_response(jsonify({'status': 'error', 'message': 'Unknown job'}), 404)
+
+    def stream():
+        version = None
+        while True:
+            if version != job.version:
+                version = job.version
+                yield f'data: {json.dumps(job.to_dict())}\n\n'
+                if job.is_done():
+                    return
+            else:
+                yield ': keep-alive\n\n'
+            jobQueue.wait_update(job, version, timeout=15.)
+    return Response(stream(), mimetype='text/event-stream')
+
+@app.route('/metrics')
+def metrics():
+    return Response(solverMetrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/sweep', methods=['POST'])
+def sweep():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('diagram'), dict):
+        return make_response(jsonify({'status': 'error', 'message': 'Invalid JSON'}), 400)
+    workers = data.get('workers')
+    workers = sweepWorkers if not isinstance(workers, int) else max(1, min(workers, sweepWorkers))
+    try:
+        results = run_sweep(data['diagram'], grid=data.get('grid'), points=data.get('points'),
+                            workers=workers)
+        first = next(results, None)
+    except Exception as e:
+        return make_response(jsonify({'status': 'error', 'message': str(e)}), 400)
+
+    def stream():
+        if first is not None:
+            yield json.dumps(first) + '\n'
+        for res in results:
+            yield json.dumps(res) + '\n'
+    return Response(stream(), mimetype='application/x-ndjson')
+
+@app.route('/scenario', methods=['POST'])
+def scenario():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('diagram'), dict):
+        return make_response(jsonify({'status': 'error', 'message': 'Invalid JSON'}), 400)
+    try:
+        results = run_scenario(data['diagram'], data.get('series'), times=data.get('times'), dt=data.get('dt'),
+                               outputs=data.get('outputs'), chunkSize=int(data.get('chunkSize', 256)),
+                               reduce=reduceNetwork)
+        header = next(results)
+    except Exception as e:
+        return make_response(jsonify({'status': 'error', 'message': str(e)}), 400)
+
+    def stream():
+        yield json.dumps(header) + '\n'
+        for chunk in results:
+            yield json.dumps(chunk) + '\n'
+    return Response(stream(), mimetype='application/x-ndjson')
+
+@app.route('/sensitivity', methods=['POST'])
+def sensitivity():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('diagram'), dict) \
+            or not isinstance(data.get('params'), list):
+        return make_response(jsonify({'status': 'error', 'message': 'Invalid JSON'}), 400)
+    status, message, result, metrics = run_sensitivity(data['diagram'], data['params'], data.get('outputs'),
+                                                       reduceNetwork)
+    return jsonify({'status': status, 'message': message, 'result': result, 'metrics': metrics})
+
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,136 @@
+import math
+
+def component(blockType, params=None):
+    return {'type': blockType, 'parameters': params or {}, 'connections': []}
+
+def connect(diagram, src, dst, outlet=1, inlet=1):
+    diagram[src]['connections'].append({'from': f'{src}.Outlet{outlet}', 'to': f'{dst}.Inlet{inlet}'})
+
+def format_values(values):
+    return ', '.join(f'{v:g}' for v in values)
+
+def pump(flow, head, speed=100):
+    return component('Pump', {'FlowRate': format_values([0, 0.5 * flow, flow]),
+                              'PressureHead': format_values([head, 0.8 * head, 0]),
+                              'PumpSpeedPct': f'{speed:g}'})
+
+def pipe(d=0.05, l=5):
+    return component('Pipe', {'InnerDiameter': f'{d:g}', 'PipeLength': f'{l:g}'})
+
+def resistance(flow=100, drop=10):
+    return component('Resistance', {'FlowRate': format_values([0, flow]),
+                                    'PressureDrop': format_values([0, drop])})
+
+def valve(flow=100, drop=10, opening=80):
+    return component('Valve', {'FlowRate': format_values([0, 0.5 * flow, flow]),
+                               'PressureDrop': format_values([0, 0.3 * drop, drop]),
+                               'ValveOpeningPct': f'{opening:g}'})
+
+def reservoir(pressure=100):
+    return component('Reservoir', {'PressureConst': f'{pressure:g}'})
+
+def series_chain(n):
+    n = max(n, 4)
+    diagram = {'Reservoir0': reservoir(), 'Pump1': pump(100, 20 * n)}
+    connect(diagram, 'Reservoir0', 'Pump1')
+    prev = 'Pump1'
+    for i in range(2, n - 1):
+        uid = f'Pipe{i}' if i % 3 else f'Valve{i}' if i % 2 else f'Resistance{i}'
+        diagram[uid] = pipe() if i % 3 else valve() if i % 2 else resistance()
+        connect(diagram, prev, uid)
+        prev = uid
+    diagram[f'Reservoir{n - 1}'] = reservoir(120)
+    connect(diagram, prev, f'Reservoir{n - 1}')
+    return diagram
+
+def splitter_tree(n):
+    depth = max(1, int(math.log2(max(n, 8) / 4)))
+    leaves = 2 ** depth
+    diagram = {'Reservoir0': reservoir(), 'Pump0': pump(10 * leaves, 400 * depth)}
+    connect(diagram, 'Reservoir0', 'Pump0')
+    sources = [('Pump0', 1)]
+    for level in range(depth):
+        nextSources = []
+        for k, (src, outlet) in enumerate(sources):
+            uid = f'Splitter{level}_{k}'
+            diagram[uid] = component('Splitter')
+            connect(diagram, src, uid, outlet)
+            nextSources += [(uid, 1), (uid, 2)]
+        sources = nextSources
+    sinks = []
+    for k, (src, outlet) in enumerate(sources):
+        diagram[f'Pipe{k}'] = pipe(0.02, 10 + k % 7)
+        diagram[f'Valve{k}'] = valve(10, 20, 50 + k % 50)
+        connect(diagram, src, f'Pipe{k}', outlet)
+        connect(diagram, f'Pipe{k}', f'Valve{k}')
+        sinks.append(f'Valve{k}')
+    for level in reversed(range(depth)):
+        nextSinks = []
+        for k in range(len(sinks) // 2):
+            uid = f'Mixer{level}_{k}'
+            diagram[uid] = component('Mixer')
+            connect(diagram, sinks[2 * k], uid, 1, 1)
+            connect(diagram, sinks[2 * k + 1], uid, 1, 2)
+            nextSinks.append(uid)
+        sinks = nextSinks
+    connect(diagram, sinks[0], 'Reservoir0')
+    return diagram
+
+def meshed_ladder(n, reservoirStride=25):
+    rungs = max(2, n // 7)
+    diagram = {'ReservoirIn': reservoir(), 'PumpIn': pump(50, 300)}
+    connect(diagram, 'ReservoirIn', 'PumpIn')
+    top = ('PumpIn', 1)
+    bottom = None
+    for k in range(rungs):
+        if k and k % reservoirStride == 0:
+            diagram[f'ReservoirFeed{k}'] = reservoir(100)
+            diagram[f'PumpFeed{k}'] = pump(50, 300, 90)
+            diagram[f'FeedMixer{k}'] = component('Mixer')
+            connect(diagram, f'ReservoirFeed{k}', f'PumpFeed{k}')
+            connect(diagram, top[0], f'FeedMixer{k}', top[1], 1)
+            connect(diagram, f'PumpFeed{k}', f'FeedMixer{k}', 1, 2)
+            top = (f'FeedMixer{k}', 1)
+            diagram[f'DrainSplitter{k}'] = component('Splitter')
+            diagram[f'DrainValve{k}'] = valve(50, 50)
+            diagram[f'ReservoirDrain{k}'] = reservoir(100)
+            connect(diagram, bottom[0], f'DrainSplitter{k}', bottom[1])
+            connect(diagram, f'DrainSplitter{k}', f'DrainValve{k}', 2)
+            connect(diagram, f'DrainValve{k}', f'ReservoirDrain{k}')
+            bottom = (f'DrainSplitter{k}', 1)
+        diagram[f'TopRail{k}'] = pipe(0.05, 20)
+        diagram[f'TopSplitter{k}'] = component('Splitter')
+        diagram[f'Rung{k}'] = pipe(0.03, 10 + k % 5)
+        diagram[f'RungResistance{k}'] = resistance(20, 40 + k % 9)
+        diagram[f'BottomMixer{k}'] = component('Mixer')
+        diagram[f'BottomRail{k}'] = pipe(0.05, 20)
+        connect(diagram, top[0], f'TopRail{k}', top[1])
+        connect(diagram, f'TopRail{k}', f'TopSplitter{k}')
+        connect(diagram, f'TopSplitter{k}', f'Rung{k}', 2)
+        connect(diagram, f'Rung{k}', f'RungResistance{k}')
+        connect(diagram, f'RungResistance{k}', f'BottomMixer{k}', 1, 2)
+        if bottom is None:
+            diagram['BottomStart'] = reservoir(100)
+            bottom = ('BottomStart', 1)
+        connect(diagram, bottom[0], f'BottomRail{k}', bottom[1])
+        connect(diagram, f'BottomRail{k}', f'BottomMixer{k}', 1, 1)
+        top = (f'TopSplitter{k}', 1)
+        bottom = (f'BottomMixer{k}', 1)
+    diagram['TopEnd'] = valve(50, 100)
+    diagram['ReservoirTopEnd'] = reservoir(100)
+    diagram['ReservoirOut'] = reservoir(100)
+    connect(diagram, top[0], 'TopEnd', top[1])
+    connect(diagram, 'TopEnd', 'ReservoirTopEnd')
+    connect(diagram, bottom[0], 'ReservoirOut', bottom[1])
+    return diagram
+
+networkTypes = {
+    'chain': series_chain,
+    'tree':  splitter_tree,
+    'mesh':  meshed_ladder
+}
+
+def generate(networkType, n):
+    if networkType not in networkTypes:
+        raise Exception(f"Unknown network type {networkType}. Use one of {', '.join(networkTypes)}.")
+    return networkTypes[networkType](n)
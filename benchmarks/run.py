@@ -0,0 +1,162 @@
+from hydraulics.diagram_handler import parse_diagram, assemble, solve_assembly
+from .networks import generate, networkTypes
+import statistics
+import subprocess
+import tracemalloc
+import platform
+import argparse
+import resource
+import json
+import time
+import sys
+import gc
+
+phases = ('parse', 'build', 'solve', 'http')
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def max_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def run_phases(diagramData, measure):
+    timings = {}
+    measure.start()
+    parsed = parse_diagram(diagramData)
+    timings['parse'] = measure.stop()
+    measure.start()
+    assy = assemble(*parsed)
+    timings['build'] = measure.stop()
+    measure.start()
+    ok = solve_assembly(assy)
+    timings['solve'] = measure.stop()
+    return timings, assy, ok
+
+class Timer:
+    def start(self):
+        self._t = time.perf_counter()
+
+    def stop(self):
+        return time.perf_counter() - self._t
+
+class MemoryPeak:
+    def start(self):
+        tracemalloc.reset_peak()
+        self._base = tracemalloc.get_traced_memory()[0]
+
+    def stop(self):
+        return tracemalloc.get_traced_memory()[1] - self._base
+
+def http_roundtrip(client, diagramData):
+    from app import resultCache
+    resultCache.invalidate()
+    body = json.dumps(diagramData)
+    start = time.perf_counter()
+    response = client.post('/solve', data=body, content_type='application/json')
+    elapsed = time.perf_counter() - start
+    status = response.get_json().get('status')
+    return elapsed, status, len(body), len(response.get_data())
+
+def run_case(networkType, size, repeat=3, http=True, memory=True):
+    diagramData = generate(networkType, size)
+    samples = {phase: [] for phase in phases}
+    result = {'network': networkType, 'size': size, 'nBlocks': len(diagramData)}
+    for _ in range(repeat):
+        gc.collect()
+        timings, assy, ok = run_phases(diagramData, Timer())
+        for phase, t in timings.items():
+            samples[phase].append(t)
+        result['nStates'] = assy.nStates
+        result['converged'] = bool(ok)
+        result['method'] = assy.solveInfo['method']
+        result['nit'] = assy.solveInfo['nit']
+        del assy
+    if http:
+        from app import app
+        for _ in range(repeat):
+            client = app.test_client()
+            elapsed, status, requestBytes, responseBytes = http_roundtrip(client, diagramData)
+            samples['http'].append(elapsed)
+        result['httpStatus'] = status
+        result['requestBytes'] = requestBytes
+        result['responseBytes'] = responseBytes
+    for phase, values in samples.items():
+        if values:
+            result[f'{phase}Time'] = min(values)
+            result[f'{phase}TimeMedian'] = statistics.median(values)
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        peaks, assy, ok = run_phases(diagramData, MemoryPeak())
+        tracemalloc.stop()
+        for phase, peak in peaks.items():
+            result[f'{phase}PeakBytes'] = peak
+        del assy
+    result['maxRssBytes'] = max_rss()
+    return result
+
+def compare(results, baseline):
+    base = {(r['network'], r['size']): r for r in baseline['results']}
+    lines = []
+    for r in results['results']:
+        b = base.get((r['network'], r['size']))
+        if b is None:
+            continue
+        ratios = []
+        for phase in phases:
+            key = f'{phase}Time'
+            if key in r and b.get(key):
+                ratios.append(f'{phase} x{r[key] / b[key]:.2f}')
+        lines.append(f"{r['network']:>6} {r['size']:>7}  " + '  '.join(ratios))
+    return lines
+
+def format_result(r):
+    times = '  '.join(f"{phase} {r[f'{phase}Time'] * 1e3:9.1f} ms" for phase in phases if f'{phase}Time' in r)
+    peaks = [r[f'{phase}PeakBytes'] for phase in phases if f'{phase}PeakBytes' in r]
+    memory = f'  peak {max(peaks) / 2**20:7.1f} MiB' if peaks else ''
+    status = 'ok' if r['converged'] else 'FAIL'
+    return f"{r['network']:>6} {r['size']:>7} {r['nBlocks']:>7} blocks  {times}{memory}  {status}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run',
+                                     description='Time parsing, assembly build, solve and the /solve round trip '
+                                                 'on synthetic networks.')
+    parser.add_argument('--networks', default=','.join(networkTypes),
+                        help='comma separated network types: ' + ', '.join(networkTypes))
+    parser.add_argument('--sizes', default='10,100,1000,10000,50000', help='comma separated block counts')
+    parser.add_argument('--repeat', type=int, default=3, help='timing repetitions per case (minimum is reported)')
+    parser.add_argument('--no-http', action='store_true', help='skip the Flask /solve round trip')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--output', '-o', help='write JSON results to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    results = {'commit': git_commit(),
+               'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'results': []}
+    for networkType in args.networks.split(','):
+        for size in map(int, args.sizes.split(',')):
+            r = run_case(networkType, size, args.repeat, not args.no_http, not args.no_memory)
+            results['results'].append(r)
+            print(format_result(r), flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {baseline.get('commit')}:")
+        for line in compare(results, baseline):
+            print(line)
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,233 @@
-from .block import HydraulicQuantity
+from .block import HydraulicQuantity, StateStore, quantityCodes
+from .compiled import CompiledAssembly, planCache
+from .disjoint_set import DisjointSet
+from .solvers import newton_solve
+from .decomposition import solve_decomposed
+from .reduction import solve_reduced
+from .continuation import solve_continuation
 from scipy.optimize import fsolve
+from scipy import sparse
+import numpy as np
+import hashlib
+import time
 
 class HydraulicAssembly:
     def __init__(self):
         self.blocks = dict()
-        self.states = []
-        self.statesMerged = []
-        self.statesConst = []
+        self.connections = dict()
+        self.store = StateStore()
+        self.nStates = 0
+        self.compiled = None
+        self.solveInfo = None
+        self._nodes = []
+        self._nodeOffset = dict()
+        self._groups = DisjointSet()
+        self._rep = []
+        self._constNode = []
+        self._isConst = []
+        self._alive = []
+        self._portLinks = dict()
+        self._nLinks = 0
+        self._nDead = 0
+        self._stateNodes = np.zeros(0, dtype=np.int64)
+        self._mergedNodes = np.zeros(0, dtype=np.int64)
+        self._mergedRep = np.zeros(0, dtype=np.int64)
+        self._constNodes = np.zeros(0, dtype=np.int64)
+        self._constSource = np.zeros(0, dtype=np.int64)
+        self._memberNodes = None
+        self._resultIndex = dict()
+        self._finalized = True
+
+    @property
+    def states(self):
+        self.finalize()
+        return [self._nodes[i] for i in self._stateNodes]
+
+    @property
+    def statesMerged(self):
+        self.finalize()
+        return [self._nodes[i] for i in self._mergedNodes]
+
+    @property
+    def statesConst(self):
+        self.finalize()
+        return [self._nodes[i] for i in self._constNodes]
+
+    @property
+    def stateMembers(self):
+        return [[self._nodes[i] for i in nodes] for nodes in self.get_memberNodes()]
 
     def add_block(self, block, uid):
         if uid in self.blocks:
             raise Exception("Cannot add a new block. Block with the specified UID already exists.")
         self.blocks[uid] = block
         block.name = uid
-        i = len(self.states)
+        self._nodeOffset[uid] = len(self._nodes)
+        blockIdx = self.store.add_block(uid)
+        constIds = set(id(state) for state in block.statesConst)
+        self.store.reserve(len(block.states))
         for state in block.states:
-            state.set_blockId(uid)
-            if state not in block.statesConst:
-                state.set_assyId(i)
-                self.states.append(state)
-                i += 1
-            else:
-                state.set_assyId(None)
-                self.statesConst.append(state)
+            i = self._groups.add()
+            self.store.attach(state, blockIdx)
+            self._nodes.append(state)
+            self._rep.append(i)
+            self._constNode.append(i if id(state) in constIds else None)
+            self._isConst.append(id(state) in constIds)
+            self._alive.append(True)
+        self.invalidate()
+
+    def remove_block(self, uid):
+        if uid not in self.blocks:
+            raise Exception("Cannot remove block. Block with the specified UID does not exist.")
+        for link in [link for link in self.connections if uid in (link[0], link[1])]:
+            self.disconnect_blocks(*link)
+        for node in self.get_blockNodes(uid):
+            self._alive[node] = False
+        self._nDead += len(self.blocks[uid].states)
+        del self.blocks[uid]
+        del self._nodeOffset[uid]
+        self.invalidate()
+        if self._nDead > max(1024, len(self._nodes) - self._nDead):
+            self.compact()
+
+    def replace_block(self, uid, block):
+        if uid not in self.blocks:
+            raise Exception("Cannot replace block. Block with the specified UID does not exist.")
+        old = self.blocks[uid]
+        if type(block) is not type(old) or len(block.states) != len(old.states) or len(block.ports) != len(old.ports):
+            links = [link for link in self.connections if uid in (link[0], link[1])]
+            self.remove_block(uid)
+            self.add_block(block, uid)
+            for link in links:
+                self.connect_blocks(*link)
+            return
+        constIds = set(id(state) for state in block.statesConst)
+        for node, state in zip(self.get_blockNodes(uid), block.states):
+            value = state.value
+            self.store.bind(state, node)
+            if id(state) in constIds:
+                state.value = value
+        for port, prev in zip(block.ports, old.ports):
+            port.connected = prev.connected
+        block.name = uid
+        self.blocks[uid] = block
+        self.compiled = None
+        if self._finalized:
+            self.refresh_params()
+
+    def compact(self):
+        blocks = self.blocks
+        links = list(self.connections)
+        self.__init__()
+        for uid, block in blocks.items():
+            for port in block.ports:
+                port.connected = False
+            self.add_block(block, uid)
+        for link in links:
+            self.connect_blocks(*link)
+
+    def invalidate(self):
+        self.compiled = None
+        self._finalized = False
+
+    def finalize(self):
+        if self._finalized:
+            return
+        n = len(self._nodes)
+        nodes = np.arange(n)
+        roots = self._groups.roots()
+        rep = np.array(self._rep, dtype=np.int64)[roots]
+        constNode = np.array([-1 if c is None else c for c in self._constNode], dtype=np.int64)[roots]
+        alive = np.array(self._alive, dtype=bool)
+        isConst = (constNode >= 0) & alive
+        isRep = ~isConst & (rep == nodes) & alive
+        self._stateNodes = nodes[isRep]
+        self.nStates = len(self._stateNodes)
+        rootId = np.full(n, -1, dtype=np.int64)
+        rootId[roots[isRep]] = np.arange(self.nStates)
+        assyIdx = np.where(isConst, -1, rootId[roots])
+        self.store.assyIdx[:n] = assyIdx
+        self._mergedNodes = nodes[~isConst & ~isRep & alive]
+        self._mergedRep = self._stateNodes[assyIdx[self._mergedNodes]]
+        self._constNodes = nodes[isConst]
+        self._constSource = constNode[isConst]
+        self.store.value[self._constNodes] = self.store.value[self._constSource]
+        self._memberNodes = None
+        self._resultIndex = dict()
+        self._finalized = True
+        self.update_mergedStVal()
+
+    def get_memberNodes(self):
+        self.finalize()
+        if self._memberNodes is None:
+            assyIdx = self.store.assyIdx[self._mergedNodes]
+            order = np.argsort(assyIdx, kind='stable')
+            counts = np.bincount(assyIdx, minlength=self.nStates)
+            merged = np.split(self._mergedNodes[order], np.cumsum(counts)[:-1]) if self.nStates else []
+            self._memberNodes = [np.concatenate(([rep], others)).astype(np.int64)
+                                 for rep, others in zip(self._stateNodes, merged)]
+        return self._memberNodes
+
+    def get_portNodes(self):
+        self.finalize()
+        if 'ports' not in self._resultIndex:
+            ids = []
+            qNodes = []
+            pNodes = []
+            for uid, block in self.blocks.items():
+                offset = self._nodeOffset[uid]
+                for i, port in enumerate(block.ports):
+                    if i < block.n_in:
+                        ids.append(f'{uid}.Inlet{i + 1}')
+                    else:
+                        ids.append(f'{uid}.Outlet{i - block.n_in + 1}')
+                    qNodes.append(offset + port.qId)
+                    pNodes.append(offset + port.pId)
+            self._resultIndex['ports'] = (ids, np.array(qNodes, dtype=np.int64), np.array(pNodes, dtype=np.int64))
+        return self._resultIndex['ports']
+
+    def get_stateNodes(self, merged=False):
+        self.finalize()
+        if ('states', merged) not in self._resultIndex:
+            nodes = np.concatenate((self._stateNodes, self._mergedNodes)) if merged else self._stateNodes
+            self._resultIndex['states', merged] = ([self.get_stateKey(node) for node in nodes], nodes)
+        return self._resultIndex['states', merged]
+
+    def get_nodeColumns(self):
+        self.finalize()
+        n = len(self._nodes)
+        columns = self.store.assyIdx[:n].copy()
+        columns[self._constNodes] = self.nStates + np.arange(len(self._constNodes))
+        return columns
+
+    def get_topologyKey(self):
+        self.finalize()
+        h = hashlib.sha256()
+        h.update(f'plan1:{self.nStates}\n'.encode())
+        h.update('\n'.join(f'{uid}:{type(block).__name__}:{block.n_in}:{block.n_out}:{len(block.states)}'
+                           for uid, block in self.blocks.items()).encode())
+        h.update(self.get_nodeColumns().tobytes())
+        return h.hexdigest()
+
+    def get_constSources(self):
+        self.finalize()
+        return self._constSource
+
+    def get_constNodes(self):
+        self.finalize()
+        return self._constNodes
+
+    def get_constValues(self):
+        self.finalize()
+        return self.store.value[self._constNodes]
+
+    def get_stateKey(self, node):
+        store = self.store
+        return f'{store.blockIds[store.blockIdx[node]]}.{store.names[node]}'
 
     def set_stateVal(self, uid, port, qnty, value):
         globalId = self.get_stateId(uid, port, qnty)
-        self.states[globalId].value = value
+        self.store.value[self._stateNodes[globalId]] = value
         self.update_mergedStVal()
 
     def get_localId(self, uid, port, qnty):
@@ -38,12 +239,20 @@ class HydraulicAssembly:
             raise Exception("Unknown state quantity. It shall be either Q or P.")
         return localId
 
+    def get_nodeId(self, uid, port, qnty):
+        return self._nodeOffset[uid] + self.get_localId(uid, port, qnty)
+
+    def get_blockNodes(self, uid):
+        start = self._nodeOffset[uid]
+        return range(start, start + len(self.blocks[uid].states))
+
     def get_stateId(self, uid, port, qnty):
+        self.finalize()
         localId = self.get_localId(uid, port, qnty)
         globalId = self.blocks[uid].states[localId].get_assyId()
         if globalId is None:
             return None
-        if globalId < 0 or globalId >= len(self.states):
+        if globalId < 0 or globalId >= self.nStates:
             raise Exception("Unknown state. It might be nonexistent in the assembly.")
         return globalId
 
@@ -55,136 +264,263 @@ class HydraulicAssembly:
         if self.blocks[uid1].ports[port1].connected or self.blocks[uid2].ports[port2].connected:
             raise Exception("Cannot connect blocks. One of the ports is already connected.")
 
-        QorP = HydraulicQuantity.Q
-        qSrcId = self.get_stateId(uid1, port1, QorP)
-        qDstId = self.get_stateId(uid2, port2, QorP)
-        if qSrcId is not None and qDstId is not None:
-            self.merge_states(qSrcId, qDstId)
-        elif qSrcId is not None:
-            self.make_constSt(uid1, port1, QorP, self.get_constVal(uid2, port2, QorP))
-        elif qDstId is not None:
-            self.make_constSt(uid2, port2, QorP, self.get_constVal(uid1, port1, QorP))
-
-        QorP = HydraulicQuantity.P
-        pSrcId = self.get_stateId(uid1, port1, QorP)
-        pDstId = self.get_stateId(uid2, port2, QorP)
-        if pSrcId is not None and pDstId is not None:
-            self.merge_states(pSrcId, pDstId)
-        elif pSrcId is not None:
-            self.make_constSt(uid1, port1, QorP, self.get_constVal(uid2, port2, QorP))
-        elif pDstId is not None:
-            self.make_constSt(uid2, port2, QorP, self.get_constVal(uid1, port1, QorP))
+        for QorP in (HydraulicQuantity.Q, HydraulicQuantity.P):
+            self.merge_nodes(self.get_nodeId(uid1, port1, QorP), self.get_nodeId(uid2, port2, QorP))
 
         self.blocks[uid1].ports[port1].connected = True
         self.blocks[uid2].ports[port2].connected = True
+        link = (uid1, uid2, port1, port2)
+        self.connections[link] = self._nLinks
+        self._nLinks += 1
+        self._portLinks[(uid1, port1)] = link
+        self._portLinks[(uid2, port2)] = link
+        self.invalidate()
 
-    def merge_states(self, srcId, dstId):
-        if srcId >= len(self.states) or dstId >= len(self.states):
-            raise Exception("Cannot merge states. Required state doesn't exist.")
+    def disconnect_blocks(self, uid1, uid2, port1=1, port2=0):
+        link = (uid1, uid2, port1, port2)
+        if link not in self.connections:
+            raise Exception("Cannot disconnect blocks. They are not connected by the specified ports.")
+        del self.connections[link]
+        del self._portLinks[(uid1, port1)]
+        del self._portLinks[(uid2, port2)]
+        self.blocks[uid1].ports[port1].connected = False
+        self.blocks[uid2].ports[port2].connected = False
+        for QorP in (HydraulicQuantity.Q, HydraulicQuantity.P):
+            self.regroup_nodes([self.get_nodeId(uid1, port1, QorP), self.get_nodeId(uid2, port2, QorP)])
+        self.invalidate()
 
-        if srcId == dstId:
-            return
-        elif srcId > dstId:
-            srcId -= 1
+    def get_linkedNodes(self, node):
+        uid = self.store.blockIds[self.store.blockIdx[node]]
+        localId = node - self._nodeOffset[uid]
+        linked = []
+        for port, blockPort in enumerate(self.blocks[uid].ports):
+            if blockPort.qId == localId:
+                qnty = HydraulicQuantity.Q
+            elif blockPort.pId == localId:
+                qnty = HydraulicQuantity.P
+            else:
+                continue
+            link = self._portLinks.get((uid, port))
+            if link is None:
+                continue
+            other = (link[1], link[3]) if (link[0], link[2]) == (uid, port) else (link[0], link[2])
+            srcNode = self.get_nodeId(link[0], link[2], qnty)
+            dstNode = self.get_nodeId(link[1], link[3], qnty)
+            linked.append((self.get_nodeId(other[0], other[1], qnty), (self.connections[link], srcNode, dstNode)))
+        return linked
 
-        dstState = self.pop_state(dstId)
-        dstState.set_assyId(srcId)
+    def regroup_nodes(self, nodes):
+        group = set(nodes)
+        stack = list(nodes)
+        merges = set()
+        while stack:
+            for node, merge in self.get_linkedNodes(stack.pop()):
+                merges.add(merge)
+                if node not in group:
+                    group.add(node)
+                    stack.append(node)
+        for node in group:
+            self._groups.reset(node)
+            self._rep[node] = node
+            self._constNode[node] = node if self._isConst[node] else None
+        for _, srcNode, dstNode in sorted(merges):
+            self.merge_nodes(srcNode, dstNode)
 
-        self.reindex_merged(srcId, dstId)
-        self.statesMerged.append(dstState)
+    def merge_nodes(self, srcNode, dstNode):
+        srcRoot = self._groups.find(srcNode)
+        dstRoot = self._groups.find(dstNode)
+        if srcRoot == dstRoot:
+            return
+        srcConst = self._constNode[srcRoot]
+        dstConst = self._constNode[dstRoot]
+        if srcConst is not None and dstConst is not None:
+            return
+        rep = self._rep[srcRoot]
+        root = self._groups.union(srcRoot, dstRoot)
+        self._rep[root] = rep
+        self._constNode[root] = srcConst if srcConst is not None else dstConst
+
+    def refresh_params(self, blocks=None):
+        self.finalize()
+        self.update_constStVal()
+        if self.compiled is not None:
+            self.compiled.refresh(self, blocks)
 
-    def pop_state(self, index):
-        state = self.states.pop(index)
-        for i in range(index, len(self.states)):
-            self.states[i].set_assyId(i)
-        return state
+    def compile(self):
+        self.finalize()
+        self.compiled = CompiledAssembly(self, planCache.get_plan(self))
+        return self.compiled
 
-    def reindex_merged(self, srcId, dstId):
-        for state in self.statesMerged:
-            i = state.get_assyId()
-            if i == dstId:
-                state.set_assyId(srcId)
-            elif i > dstId:
-                state.set_assyId(i - 1)
+    def update_constStVal(self):
+        value = self.store.value
+        value[self._constNodes] = value[self._constSource]
 
     def update_mergedStVal(self):
-        for state in self.statesMerged:
-            i = state.get_assyId()
-            state.value = self.states[i].value
-
-    def make_constSt(self, uid, port, qnty, value):
-        constId = self.get_stateId(uid, port, qnty)
-        constState = self.pop_state(constId)
-        constState.set_assyId(None)
-        constState.value = value
-
-        self.reindex_merged(None, constId)
-        self.statesConst.append(constState)
-
-        for state in self.statesMerged:
-            i = state.get_assyId()
-            if i is None:
-                state.value = value
-                self.statesConst.append(state)
-        self.statesMerged = [state for state in self.statesMerged if state.get_assyId() is not None]
+        value = self.store.value
+        value[self._mergedNodes] = value[self._mergedRep]
 
     def get_constVal(self, uid, port, qnty):
         localId = self.get_localId(uid, port, qnty)
         return self.blocks[uid].states[localId].value
 
     def get_avg_pressure(self):
+        self.finalize()
         p = 0
-        if not self.statesConst:
+        if not len(self._constNodes):
             return p
-        for state in self.statesConst:
-            if state.qnty == HydraulicQuantity.P:
-                p += state.value
-        p /= len(self.statesConst)
+        isP = self.store.qnty[self._constNodes] == quantityCodes[HydraulicQuantity.P]
+        p = float(self.store.value[self._constNodes[isP]].sum())
+        p /= len(self._constNodes)
         return p
 
     def set_init_pressure(self, p0):
-        for state in self.states:
-            if state.qnty == HydraulicQuantity.P:
-                state.value = p0
+        self.finalize()
+        nodes = self._stateNodes
+        self.store.value[nodes[self.store.qnty[nodes] == quantityCodes[HydraulicQuantity.P]]] = p0
         self.update_mergedStVal()
 
+    def set_init_values(self, values, p0=None):
+        self.finalize()
+        if p0 is None:
+            p0 = self.get_avg_pressure()
+        isP = self.store.qnty[self._stateNodes] == quantityCodes[HydraulicQuantity.P]
+        x0 = np.where(isP, p0, 0.)
+        found = np.zeros(self.nStates, dtype=bool)
+        for i, node in enumerate(self._stateNodes):
+            key = self.get_stateKey(node)
+            if key in values:
+                x0[i] = values[key]
+                found[i] = True
+        for node in self._mergedNodes:
+            i = self.store.assyIdx[node]
+            if found[i]:
+                continue
+            key = self.get_stateKey(node)
+            if key in values:
+                x0[i] = values[key]
+                found[i] = True
+        self.set_states_val(x0)
+        return int(found.sum())
+
     def get_init_values(self):
-        x0 = []
-        for state in self.states:
-            x0.append(state.value)
-        return x0
+        self.finalize()
+        return self.store.value[self._stateNodes].tolist()
 
     def set_states_val(self, x):
-        for i in range(len(self.states)):
-            self.states[i].value = x[i]
+        self.store.value[self._stateNodes] = np.asarray(x, dtype=float)[:self.nStates]
         self.update_mergedStVal()
 
     def qp_balance(self, x):
+        if self.compiled is not None:
+            return self.compiled.qp_balance(x)
+        return self.qp_balance_ref(x)
+
+    def qp_balance_ref(self, x):
+        self.finalize()
         self.set_states_val(x)
         y = []
         for block in self.blocks.values():
             balance = block.qp_balance()
             if balance is not None:
-                y.append(block.qp_balance())
+                y.append(balance)
         return y
 
-    def solve(self):
+    def qp_jacobian(self, x):
+        if self.compiled is not None:
+            return self.compiled.qp_jacobian(x)
+        return self.qp_jacobian_ref(x)
+
+    def qp_jacobian_ref(self, x):
+        self.finalize()
+        self.set_states_val(x)
+        rows = []
+        cols = []
+        data = []
+        i = 0
+        for block in self.blocks.values():
+            dydx = block.qp_jacobian()
+            if dydx is None:
+                continue
+            for state, d in zip(block.states, dydx):
+                j = state.get_assyId()
+                if j is not None:
+                    rows.append(i)
+                    cols.append(j)
+                    data.append(d)
+            i += 1
+        return sparse.csr_matrix((data, (rows, cols)), shape=(i, max(len(x), self.nStates)))
+
+    def get_eqBlockIds(self):
+        if self.compiled is not None:
+            return self.compiled.eqBlockIds
+        return [uid for uid, block in self.blocks.items() if block.qp_balance() is not None]
+
+    def solve(self, method='newton', workers=None, reduce=False):
         # TODO: check connections
+        start = time.perf_counter()
+        self.finalize()
         x0 = self.get_init_values()
         y = self.qp_balance(x0)
         if (len(x0) > len(y)):
             raise Exception("Not enough balance equations to solve for all unknown Q and P.")
-        elif (len(x0) < len(y)):
+        stats = {'method': method, 'nfev': 1, 'njev': 0, 'nit': 0}
+        ok = False
+        if reduce:
+            ok, info = solve_reduced(self, x0, xtol=1e-6)
+            self.add_solveStats(stats, info)
+            ok = bool(ok)
+            if ok:
+                stats['method'] = 'reduced'
+                x = self.get_init_values()
+            else:
+                self.set_states_val(x0)
+        if not ok and method == 'decomposed':
+            ok, info = solve_decomposed(self, x0, workers=workers, xtol=1e-6)
+            self.add_solveStats(stats, info)
+            ok = bool(ok)
+            if ok:
+                x = self.get_init_values()
+            else:
+                self.set_states_val(x0)
+        if not ok and method in ('newton', 'decomposed'):
+            stats['method'] = 'newton'
+            x, info, ok = newton_solve(self.qp_balance, self.qp_jacobian, x0, xtol=1e-6)
+            self.add_solveStats(stats, info)
+        if not ok and method in ('newton', 'decomposed'):
+            ok, info = solve_continuation(self, x0, xtol=1e-6)
+            self.add_solveStats(stats, info)
+            ok = bool(ok)
+            if ok:
+                stats['method'] = 'continuation'
+                x = self.get_init_values()
+        if not ok:
+            stats['method'] = 'fsolve'
             for i in range(len(y) - len(x0)):
                 x0.append(0.)
-        x, info, ier, msg = fsolve(self.qp_balance, x0, xtol=1e-6, full_output=True)
+            fprime = lambda x: self.qp_jacobian(x).toarray()
+            x, info, ier, msg = fsolve(self.qp_balance, x0, fprime=fprime, xtol=1e-6, full_output=True)
+            self.add_solveStats(stats, info)
+            ok = ier == 1
         self.set_states_val(x)
-        return x, ier == 1
-
-    def states_to_dict(self):
-        keys = []
-        vals = []
-        for state in self.states:
-            keys.append(f'{state.get_blockId()}.{state.name}')
-            vals.append(state.value)
-        return dict(zip(keys, vals))
+
+        y = np.asarray(self.qp_balance(x), dtype=float)
+        stats['converged'] = bool(ok)
+        stats['residualNorm'] = float(np.linalg.norm(y)) if len(y) else 0.
+        stats['worstBlock'] = self.get_eqBlockIds()[int(np.argmax(np.abs(y)))] if len(y) else None
+        stats['solveTime'] = time.perf_counter() - start
+        self.solveInfo = stats
+        return x, ok
+
+    def add_solveStats(self, stats, info):
+        for key in ('nfev', 'njev', 'nit', 'components', 'blocks', 'reducedStates', 'continuationSteps'):
+            if key in info:
+                stats[key] = stats.get(key, 0) + int(info[key])
+
+    def get_sensitivities(self, params, outputs=None):
+        from .sensitivity import compute_sensitivities
+        return compute_sensitivities(self, params, outputs)
+
+    def states_to_dict(self, merged=False):
+        self.finalize()
+        keys, nodes = self.get_stateNodes(merged)
+        return dict(zip(keys, self.store.value[nodes].tolist()))
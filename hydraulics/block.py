@@ -1,31 +1,116 @@
 from enum import Enum
+import numpy as np
 import abc
 
 class HydraulicQuantity(str, Enum):
     P = 'P'
     Q = 'Q'
 
+quantities = (HydraulicQuantity.Q, HydraulicQuantity.P)
+quantityCodes = {HydraulicQuantity.Q: 0, HydraulicQuantity.P: 1}
+
+class StateStore:
+    def __init__(self, capacity=64):
+        self.value = np.zeros(capacity)
+        self.qnty = np.zeros(capacity, dtype=np.int8)
+        self.blockIdx = np.zeros(capacity, dtype=np.int32)
+        self.assyIdx = np.full(capacity, -1, dtype=np.int64)
+        self.names = []
+        self.blockIds = []
+        self.size = 0
+
+    def reserve(self, n):
+        capacity = len(self.value)
+        if self.size + n <= capacity:
+            return
+        capacity = max(2 * capacity, self.size + n)
+        for attr, fill in (('value', 0.), ('qnty', 0), ('blockIdx', 0), ('assyIdx', -1)):
+            old = getattr(self, attr)
+            new = np.full(capacity, fill, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, attr, new)
+
+    def add_block(self, uid):
+        self.blockIds.append(uid)
+        return len(self.blockIds) - 1
+
+    def attach(self, state, blockIdx):
+        self.reserve(1)
+        i = self.size
+        value, qnty, name = state.value, state.qnty, state.name
+        self.value[i] = value
+        self.qnty[i] = quantityCodes[qnty]
+        self.blockIdx[i] = blockIdx
+        self.assyIdx[i] = -1
+        self.names.append(name)
+        self.size += 1
+        self.bind(state, i)
+        return i
+
+    def bind(self, state, i):
+        state._store = self
+        state._i = i
+        state._local = None
+
 class BlockState:
+    __slots__ = ('_store', '_i', '_local')
+
     def __init__(self, qnty: HydraulicQuantity, name: str, value=0):
-        self.qnty = qnty
-        self.name = name
-        self.value = value
-        self._blockId = None
-        self._assyId = None
+        self._store = None
+        self._i = None
+        self._local = [value, qnty, name, None, None]
+
+    @property
+    def value(self):
+        store = self._store
+        return self._local[0] if store is None else store.value[self._i]
+
+    @value.setter
+    def value(self, value):
+        store = self._store
+        if store is None:
+            self._local[0] = value
+        else:
+            store.value[self._i] = value
+
+    @property
+    def qnty(self):
+        store = self._store
+        return self._local[1] if store is None else quantities[store.qnty[self._i]]
+
+    @property
+    def name(self):
+        store = self._store
+        return self._local[2] if store is None else store.names[self._i]
 
     def set_blockId(self, id):
-        self._blockId = id
+        store = self._store
+        if store is None:
+            self._local[3] = id
+        else:
+            store.blockIds[store.blockIdx[self._i]] = id
 
     def get_blockId(self):
-        return self._blockId
+        store = self._store
+        return self._local[3] if store is None else store.blockIds[store.blockIdx[self._i]]
 
     def set_assyId(self, id):
-        self._assyId = id
+        store = self._store
+        if store is None:
+            self._local[4] = id
+        else:
+            store.assyIdx[self._i] = -1 if id is None else id
 
     def get_assyId(self):
-        return self._assyId
+        store = self._store
+        if store is None:
+            return self._local[4]
+        i = store.assyIdx[self._i]
+        return None if i < 0 else int(i)
 
 class BlockPort:
+    __slots__ = ('name', 'qId', 'pId', 'connected')
+
     def __init__(self, name: str, qId, pId):
         self.name = name
         self.qId = qId
@@ -44,3 +129,16 @@ class HydraulicBlock:
     @abc.abstractmethod
     def qp_balance(self, *args):
         pass
+
+    def qp_jacobian(self):
+        y0 = self.qp_balance()
+        if y0 is None:
+            return None
+        dydx = []
+        for state in self.states:
+            x0 = state.value
+            dx = 1e-7 * max(abs(x0), 1.)
+            state.value = x0 + dx
+            dydx.append((self.qp_balance() - y0) / dx)
+            state.value = x0
+        return dydx
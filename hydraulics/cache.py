@@ -0,0 +1,146 @@
+from collections import OrderedDict
+import threading
+import hashlib
+import json
+import time
+
+def normalize_param(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return [float(value)]
+    if isinstance(value, (list, tuple)):
+        try:
+            return [float(v) for v in value]
+        except (TypeError, ValueError):
+            return [normalize_param(v) for v in value]
+    if isinstance(value, str):
+        text = value.replace('[', '').replace(']', '').replace(';', ',')
+        textVals = [t.strip() for t in text.split(',') if t.strip() != '']
+        try:
+            return [float(t) for t in textVals]
+        except ValueError:
+            return value.strip()
+    return value
+
+def canonical_diagram(diagramData):
+    canon = {}
+    for uid, comp in diagramData.items():
+        if not isinstance(comp, dict):
+            canon[uid] = comp
+            continue
+        entry = dict(comp)
+        params = comp.get('parameters')
+        if isinstance(params, dict):
+            entry['parameters'] = {k: normalize_param(v) for k, v in params.items()}
+        conns = comp.get('connections')
+        if isinstance(conns, list):
+            entry['connections'] = sorted(conns, key=lambda c: json.dumps(c, sort_keys=True))
+        canon[uid] = entry
+    return canon
+
+def diagram_hash(diagramData):
+    text = json.dumps(canonical_diagram(diagramData), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, maxEntries=256, maxBytes=64 * 2**20, ttl=600.):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._nBytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        size = len(json.dumps(value, default=str))
+        if self.maxBytes is not None and size > self.maxBytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic(), value, size)
+            self._nBytes += size
+            while (len(self._entries) > self.maxEntries or
+                   (self.maxBytes is not None and self._nBytes > self.maxBytes)):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                n = len(self._entries)
+                self._entries.clear()
+                self._nBytes = 0
+                return n
+            if key in self._entries:
+                self._drop(key)
+                return 1
+            return 0
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._nBytes -= entry[2]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'bytes': self._nBytes,
+                    'maxEntries': self.maxEntries,
+                    'maxBytes': self.maxBytes,
+                    'ttl': self.ttl,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+class ObjectCache:
+    def __init__(self, maxEntries=64, ttl=1800.):
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries[key] = (time.monotonic(), entry[1])
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic(), value)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+
+    def drop(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
@@ -0,0 +1,110 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .diagram_handler import run_solver
+import argparse
+import json
+import time
+import sys
+import os
+
+def iter_sources(paths):
+    for path in paths:
+        if path == '-':
+            for i, line in enumerate(sys.stdin, 1):
+                if line.strip():
+                    yield '<stdin>', i, line
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(('.json', '.jsonl')):
+                        yield from iter_sources([os.path.join(root, name)])
+        elif path.endswith('.jsonl'):
+            with open(path) as f:
+                for i, line in enumerate(f, 1):
+                    if line.strip():
+                        yield path, i, line
+        else:
+            yield path, None, None
+
+def load_diagram(source, text):
+    if text is None:
+        with open(source) as f:
+            text = f.read()
+    diagramData = json.loads(text)
+    if isinstance(diagramData, dict) and isinstance(diagramData.get('diagram'), dict):
+        diagramData = diagramData['diagram']
+    if not isinstance(diagramData, dict):
+        raise Exception("Diagram data shall be a JSON object of components.")
+    return diagramData
+
+def solve_source(source, line, text, resultFormat='text', reduce=False):
+    start = time.perf_counter()
+    record = {'source': source}
+    if line is not None:
+        record['line'] = line
+    try:
+        diagramData = load_diagram(source, text)
+        loadTime = time.perf_counter() - start
+        status, message, result, metrics = run_solver(diagramData, resultFormat=resultFormat, reduce=reduce)
+        metrics['loadTime'] = loadTime
+    except Exception as e:
+        status, message, result, metrics = 'error', str(e), {}, {}
+    record.update({'status': status, 'message': message, 'result': result, 'metrics': metrics,
+                   'totalTime': time.perf_counter() - start, 'pid': os.getpid()})
+    return record
+
+def run_batch(paths, out, workers=None, maxPending=None, resultFormat='text', reduce=False):
+    workers = workers or os.cpu_count() or 1
+    maxPending = maxPending or 4 * workers
+    counts = dict()
+    sources = iter_sources(paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < maxPending:
+                task = next(sources, None)
+                if task is None:
+                    exhausted = True
+                else:
+                    pending.add(pool.submit(solve_source, *task, resultFormat, reduce))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                record = future.result()
+                counts[record['status']] = counts.get(record['status'], 0) + 1
+                out.write(json.dumps(record) + '\n')
+                out.flush()
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m hydraulics.cli',
+                                     description='Solve diagram JSON files, directories of them or JSONL streams '
+                                                 'and write one JSON result per line as each diagram finishes.')
+    parser.add_argument('inputs', nargs='+',
+                        help='diagram .json files, .jsonl files with one diagram per line, directories, '
+                             'or - to read JSONL from stdin')
+    parser.add_argument('--output', '-o', help='write results to this JSONL file instead of stdout')
+    parser.add_argument('--workers', '-j', type=int, help='solver processes (default: number of cores)')
+    parser.add_argument('--numeric', action='store_true',
+                        help='write Q and P arrays per port and all states instead of formatted text')
+    parser.add_argument('--reduce', action='store_true',
+                        help='collapse series and parallel pipes and resistances before solving')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        counts = run_batch(args.inputs, out, args.workers,
+                           resultFormat='numeric' if args.numeric else 'text', reduce=args.reduce)
+    finally:
+        if args.output:
+            out.close()
+    summary = ', '.join(f'{n} {status}' for status, n in sorted(counts.items())) or 'no diagrams'
+    print(f'Solved {sum(counts.values())} diagrams in {time.perf_counter() - start:.2f} s: {summary}',
+          file=sys.stderr)
+    return 0 if set(counts) <= {'success'} else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
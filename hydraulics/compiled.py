@@ -0,0 +1,417 @@
+from . import pumps, loads, joints
+from .friction import friction_re
+from .cache import ObjectCache
+from .metrics import planLookups
+from scipy import sparse
+import numpy as np
+import abc
+import os
+import sys
+
+def stack_tables(xData, fData):
+    n = len(xData)
+    m = max(len(x) for x in xData)
+    xp = np.empty((n, m))
+    fp = np.empty((n, m))
+    for i in range(n):
+        k = len(xData[i])
+        xp[i, :k] = xData[i]
+        xp[i, k:] = xData[i][-1]
+        fp[i, :k] = fData[i]
+        fp[i, k:] = fData[i][-1]
+    return xp, fp
+
+def table_slopes(xp, fp):
+    dx = np.diff(xp, axis=1)
+    df = np.diff(fp, axis=1)
+    return np.divide(df, dx, out=np.zeros_like(df), where=dx != 0)
+
+def interp_rows(x, xp, fp, slopes, tables):
+    xt = xp[tables]
+    xc = np.clip(x, xt[:, 0], xt[:, -1])
+    k = np.minimum((xt[:, 1:] < xc[:, None]).sum(axis=1), xp.shape[1] - 2)
+    return fp[tables, k] + (xc - xt[np.arange(len(x)), k]) * slopes[tables, k]
+
+def slope_rows(x, xp, slopes, tables):
+    xt = xp[tables]
+    k = np.minimum((xt[:, 1:] < x[:, None]).sum(axis=1), xp.shape[1] - 2)
+    inside = (x >= xt[:, 0]) & (x <= xt[:, -1])
+    return np.where(inside, slopes[tables, k], 0.)
+
+def last_segment(curves):
+    x = np.array([c.x[-2] for c in curves])
+    f = np.array([c.f[-2] for c in curves])
+    slope = np.array([c.slopeLast for c in curves])
+    return x, f, slope
+
+
+class BlockGroup(abc.ABC):
+    def __init__(self, blocks, rows, index):
+        self.blocks = blocks
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.index = np.asarray(index, dtype=np.int64)
+        self.refresh()
+
+    def refresh(self):
+        pass
+
+    @abc.abstractmethod
+    def qp_balance(self, z):
+        pass
+
+    @abc.abstractmethod
+    def qp_jacobian(self, z):
+        pass
+
+
+class CurveGroup(BlockGroup):
+    def set_curves(self, curves):
+        unique = dict()
+        self.tableIdx = np.array([unique.setdefault(id(c), (len(unique), c))[0] for c in curves], dtype=np.int64)
+        tables = [c for i, c in unique.values()]
+        self.xPrev, self.fPrev, self.slopeLast = last_segment(tables)
+        self.xp, self.fp = stack_tables([c.x for c in tables], [c.f for c in tables])
+        self.slopes = table_slopes(self.xp, self.fp)
+
+    def lut(self, x, xLast):
+        t = self.tableIdx
+        inside = interp_rows(x, self.xp, self.fp, self.slopes, t)
+        outside = self.fPrev[t] + (x - self.xPrev[t]) * self.slopeLast[t]
+        return np.where(x <= xLast, inside, outside)
+
+    def lut_slope(self, x, xLast):
+        t = self.tableIdx
+        return np.where(x <= xLast, slope_rows(x, self.xp, self.slopes, t), self.slopeLast[t])
+
+
+class PumpGroup(CurveGroup):
+    def refresh(self):
+        self.speedFrac = np.array([b.get_speedPct() for b in self.blocks]) / 100.
+        self.qLast = np.array([b.qLast for b in self.blocks])
+        self.set_curves([b.lut for b in self.blocks])
+
+    def qp_lut(self, q):
+        q = np.maximum(q, 0)
+        return np.where(self.speedFrac == 0, 0., self.lut(q, self.qLast))
+
+    def qp_balance(self, z):
+        q, p_in, p_out = z[self.index].T
+        return p_out - p_in - self.qp_lut(q)
+
+    def qp_jacobian(self, z):
+        q = z[self.index[:, 0]]
+        dpdq = np.where((self.speedFrac == 0) | (q < 0), 0., self.lut_slope(q, self.qLast))
+        ones = np.ones_like(q)
+        return np.column_stack((-dpdq, -ones, ones))
+
+
+class ResistanceGroup(CurveGroup):
+    def refresh(self):
+        self.qLast = np.array([b.qLast for b in self.blocks])
+        self.set_curves([b.curve for b in self.blocks])
+
+    def qp_lut(self, q):
+        return np.sign(q) * self.lut(np.abs(q), self.qLast)
+
+    def qp_drop(self, q):
+        return self.qp_lut(q), self.lut_slope(np.abs(q), self.qLast)
+
+    def qp_balance(self, z):
+        q, p_in, p_out = z[self.index].T
+        return p_in - p_out - self.qp_lut(q)
+
+    def qp_jacobian(self, z):
+        dpdq = self.lut_slope(np.abs(z[self.index[:, 0]]), self.qLast)
+        ones = np.ones_like(dpdq)
+        return np.column_stack((-dpdq, ones, -ones))
+
+
+class ValveGroup(CurveGroup):
+    def refresh(self):
+        self.openFrac = np.array([b.get_openPct() for b in self.blocks]) / 100.
+        self.pLast = np.array([b.pLast for b in self.blocks])
+        self.set_curves([b.curve for b in self.blocks])
+
+    def pq_lut(self, p):
+        return np.sign(p) * self.openFrac * self.lut(np.abs(p), self.pLast)
+
+    def qp_balance(self, z):
+        q, p_in, p_out = z[self.index].T
+        return q - self.pq_lut(p_in - p_out)
+
+    def qp_jacobian(self, z):
+        q, p_in, p_out = z[self.index].T
+        dqdp = self.openFrac * self.lut_slope(np.abs(p_in - p_out), self.pLast)
+        return np.column_stack((np.ones_like(q), -dqdp, dqdp))
+
+
+class PipeGroup(BlockGroup):
+    def refresh(self):
+        for block in self.blocks:
+            block.update_constants()
+        self.reCoef = np.array([b.reCoef for b in self.blocks], dtype=float)
+        self.dpCoef = np.array([b.dpCoef for b in self.blocks], dtype=float)
+        relRough = np.array([np.nan if b.relRough is None else b.relRough for b in self.blocks], dtype=float)
+        self.relRough = None if np.all(np.isnan(relRough)) else relRough
+
+    def qp_drop(self, q):
+        Re = self.reCoef * np.abs(q)
+        g, dg = friction_re(Re, self.relRough)
+        return self.dpCoef * g * q, self.dpCoef * (g + Re * dg)
+
+    def qp_balance(self, z):
+        q, p_in, p_out = z[self.index].T
+        g, dg = friction_re(self.reCoef * np.abs(q), self.relRough)
+        return p_in - p_out - self.dpCoef * g * q
+
+    def qp_jacobian(self, z):
+        q = z[self.index[:, 0]]
+        Re = self.reCoef * np.abs(q)
+        g, dg = friction_re(Re, self.relRough)
+        dpdq = self.dpCoef * (g + Re * dg)
+        ones = np.ones_like(q)
+        return np.column_stack((-dpdq, ones, -ones))
+
+
+class JointGroup(BlockGroup):
+    def refresh(self):
+        block = self.blocks[0]
+        self.weights = np.array([1.] * block.n_in + [-1.] * block.n_out + [0.])
+
+    def qp_balance(self, z):
+        return z[self.index] @ self.weights
+
+    def qp_jacobian(self, z):
+        return np.broadcast_to(self.weights, self.index.shape)
+
+
+class ObjectGroup(BlockGroup):
+    def qp_balance(self, z):
+        y = np.empty(len(self.blocks))
+        for i, block in enumerate(self.blocks):
+            for state, j in zip(block.states, self.index[i]):
+                state.value = z[j]
+            y[i] = block.qp_balance()
+        return y
+
+    def qp_jacobian(self, z):
+        dydx = np.empty(self.index.shape)
+        for i, block in enumerate(self.blocks):
+            for state, j in zip(block.states, self.index[i]):
+                state.value = z[j]
+            dydx[i] = block.qp_jacobian()
+        return dydx
+
+
+groupTypeDict = {
+    pumps.CentrifugalPump:      PumpGroup,
+    loads.HydraulicResistance:  ResistanceGroup,
+    loads.HydraulicValve:       ValveGroup,
+    loads.HydraulicPipe:        PipeGroup,
+    joints.TeeSplit:            JointGroup,
+    joints.TeeJoin:             JointGroup,
+    joints.MultiPortJoint:      JointGroup,
+    joints.HeaderTank:          None
+}
+
+groupTypes = {groupType.__name__: groupType
+              for groupType in (PumpGroup, ResistanceGroup, ValveGroup, PipeGroup, JointGroup, ObjectGroup)}
+
+class TopologyPlan:
+    def __init__(self, key, nStates, groups, jacobian=None):
+        self.key = key
+        self.nStates = nStates
+        self.groups = groups
+        self.nEquations = sum(len(rows) for groupType, names, rows, index in groups)
+        self.eqBlockIds = [None] * self.nEquations
+        self.rowGroup = np.empty(self.nEquations, dtype=np.int64)
+        self.rowSlot = np.empty(self.nEquations, dtype=np.int64)
+        self.jacMasks = []
+        jacRows = []
+        jacCols = []
+        for g, (groupType, names, rows, index) in enumerate(groups):
+            for row, name in zip(rows.tolist(), names):
+                self.eqBlockIds[row] = name
+            self.rowGroup[rows] = g
+            self.rowSlot[rows] = np.arange(len(rows))
+            cols = index.ravel()
+            mask = cols < nStates
+            self.jacMasks.append(mask)
+            jacRows.append(np.repeat(rows, index.shape[1])[mask])
+            jacCols.append(cols[mask])
+        if jacobian is None:
+            jacobian = self.index_jacobian(jacRows, jacCols)
+        self.jacPos, self.jacIndices, self.jacIndptr = jacobian
+
+    def index_jacobian(self, jacRows, jacCols):
+        width = max(self.nStates, 1)
+        keys = np.concatenate(jacRows + [np.zeros(0, dtype=np.int64)]) * width + \
+            np.concatenate(jacCols + [np.zeros(0, dtype=np.int64)])
+        entries, pos = np.unique(keys, return_inverse=True)
+        indices = (entries % width).astype(np.int32)
+        counts = np.bincount(entries // width, minlength=self.nEquations)
+        indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int32)
+        return pos.ravel(), indices, indptr
+
+    @classmethod
+    def build(cls, assy, key=None):
+        columns = assy.get_nodeColumns().tolist()
+        nEquations = 0
+        members = dict()
+        for block in assy.blocks.values():
+            blockType = type(block)
+            if blockType in groupTypeDict:
+                groupType = groupTypeDict[blockType]
+                if groupType is None:
+                    continue
+            elif block.qp_balance() is not None:
+                groupType = ObjectGroup
+            else:
+                continue
+            index = [columns[i] for i in assy.get_blockNodes(block.name)]
+            names, rows, indices = members.setdefault((groupType, len(index), block.n_in, block.n_out), ([], [], []))
+            names.append(block.name)
+            rows.append(nEquations)
+            indices.append(index)
+            nEquations += 1
+        groups = [(groupKey[0], names, np.array(rows, dtype=np.int64),
+                   np.array(indices, dtype=np.int64).reshape(len(rows), groupKey[1]))
+                  for groupKey, (names, rows, indices) in members.items()]
+        return cls(key, assy.nStates, groups)
+
+    def save(self, path):
+        arrays = {'nStates': np.array(self.nStates),
+                  'groupTypes': np.array([groupType.__name__ for groupType, names, rows, index in self.groups]),
+                  'jacPos': self.jacPos,
+                  'jacIndices': self.jacIndices,
+                  'jacIndptr': self.jacIndptr}
+        for g, (groupType, names, rows, index) in enumerate(self.groups):
+            arrays[f'names{g}'] = np.array(names)
+            arrays[f'rows{g}'] = rows
+            arrays[f'index{g}'] = index
+        tmpPath = f'{path}.{os.getpid()}.tmp'
+        with open(tmpPath, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmpPath, path)
+
+    @classmethod
+    def load(cls, path, key=None):
+        with np.load(path) as data:
+            groups = [(groupTypes[name], data[f'names{g}'].tolist(), data[f'rows{g}'], data[f'index{g}'])
+                      for g, name in enumerate(data['groupTypes'].tolist())]
+            jacobian = (data['jacPos'], data['jacIndices'], data['jacIndptr'])
+            return cls(key, int(data['nStates']), groups, jacobian)
+
+
+class PlanCache:
+    def __init__(self, maxEntries=64, path=None):
+        self.path = path
+        self._plans = ObjectCache(maxEntries, ttl=float('inf'))
+
+    def get_plan(self, assy):
+        key = assy.get_topologyKey()
+        plan = self._plans.get(key)
+        if plan is not None:
+            planLookups.inc(result='hit')
+            return plan
+        result = 'miss'
+        path = os.path.join(self.path, key + '.npz') if self.path else None
+        if path is not None and os.path.exists(path):
+            try:
+                plan = TopologyPlan.load(path, key)
+                result = 'disk'
+            except Exception as e:
+                print('Error in loading compiled topology plan: ' + str(e), file=sys.stderr)
+        if plan is None:
+            plan = TopologyPlan.build(assy, key)
+            if path is not None:
+                try:
+                    os.makedirs(self.path, exist_ok=True)
+                    plan.save(path)
+                except OSError as e:
+                    print('Error in saving compiled topology plan: ' + str(e), file=sys.stderr)
+        self._plans.put(key, plan)
+        planLookups.inc(result=result)
+        return plan
+
+
+planCache = PlanCache(maxEntries=int(os.environ.get('HYDRUI_PLAN_ENTRIES', 64)),
+                      path=os.environ.get('HYDRUI_PLAN_DIR') or None)
+
+
+class CompiledAssembly:
+    def __init__(self, assy, plan=None):
+        self.setup(plan or TopologyPlan.build(assy), assy.blocks, assy.get_constValues())
+
+    def setup(self, plan, blocks, constVal):
+        self.plan = plan
+        self.nStates = plan.nStates
+        self.nEquations = plan.nEquations
+        self.eqBlockIds = plan.eqBlockIds
+        self.constVal = constVal
+        self.groups = [groupType([blocks[name] for name in names], rows, index)
+                       for groupType, names, rows, index in plan.groups]
+        self.blockGroups = {id(block): group for group in self.groups for block in group.blocks}
+
+    def subsystem(self, rows, cols):
+        plan = self.plan
+        groupIdx = plan.rowGroup[rows]
+        order = np.argsort(groupIdx, kind='stable')
+        bounds = np.flatnonzero(np.diff(groupIdx[order])) + 1
+        parts = []
+        for members in np.split(order, bounds):
+            if len(members) == 0:
+                continue
+            group = self.groups[groupIdx[members[0]]]
+            slots = plan.rowSlot[rows[members]]
+            parts.append((group, slots, members))
+        used = np.unique(np.concatenate([group.index[slots].ravel() for group, slots, members in parts] +
+                                        [np.zeros(0, dtype=np.int64)]))
+        extCols = np.setdiff1d(used, cols)
+        layout = np.concatenate((cols, extCols))
+        layoutOrder = np.argsort(layout)
+        sortedLayout = layout[layoutOrder]
+        blocks = dict()
+        groups = []
+        for group, slots, members in parts:
+            names = []
+            for i in slots.tolist():
+                block = group.blocks[i]
+                blocks[block.name] = block
+                names.append(block.name)
+            index = layoutOrder[np.searchsorted(sortedLayout, group.index[slots])]
+            groups.append((type(group), names, members, index))
+        sub = CompiledAssembly.__new__(CompiledAssembly)
+        sub.setup(TopologyPlan(None, len(cols), groups), blocks, np.zeros(len(extCols)))
+        sub.extCols = extCols
+        return sub
+
+    def refresh(self, assy, blocks=None):
+        self.constVal = assy.get_constValues()
+        if blocks is None:
+            groups = self.groups
+        else:
+            groups = {id(g): g for g in (self.blockGroups.get(id(b)) for b in blocks) if g is not None}.values()
+        for group in groups:
+            group.refresh()
+
+    def expand(self, x):
+        return np.concatenate((np.asarray(x, dtype=float)[:self.nStates], self.constVal))
+
+    def qp_balance(self, x):
+        z = self.expand(x)
+        y = np.empty(self.nEquations)
+        for group in self.groups:
+            y[group.rows] = group.qp_balance(z)
+        return y
+
+    def qp_jacobian(self, x):
+        z = self.expand(x)
+        plan = self.plan
+        shape = (self.nEquations, max(len(x), self.nStates))
+        if not self.groups:
+            return sparse.csr_matrix(shape)
+        values = np.concatenate([np.ravel(group.qp_jacobian(z))[mask]
+                                 for group, mask in zip(self.groups, plan.jacMasks)])
+        data = np.bincount(plan.jacPos, weights=values, minlength=len(plan.jacIndices))
+        return sparse.csr_matrix((data, plan.jacIndices.copy(), plan.jacIndptr.copy()), shape=shape)
@@ -0,0 +1,70 @@
+from .solvers import newton_solve
+import numpy as np
+import time
+
+rampParams = [
+    ('get_speedPct',    'set_speedPct', 0.),
+    ('get_openPct',     'set_openPct',  100.)
+]
+
+def ramp_targets(assy):
+    targets = []
+    for block in assy.blocks.values():
+        for getter, setter, easy in rampParams:
+            if hasattr(block, setter):
+                target = getattr(block, getter)()
+                if target != easy:
+                    targets.append((block, getattr(block, setter), easy, target))
+    return targets
+
+def set_homotopy(assy, targets, lam):
+    for block, setter, easy, target in targets:
+        setter(easy + lam * (target - easy))
+    assy.refresh_params([t[0] for t in targets])
+
+def newton_stage(assy, x, xtol, stats, maxIter=100):
+    x, info, ok = newton_solve(assy.qp_balance, assy.qp_jacobian, x, xtol=xtol, maxIter=maxIter)
+    for key in ('nfev', 'njev', 'nit'):
+        stats[key] += info[key]
+    return x, info['nit'], ok
+
+def solve_continuation(assy, x0, xtol=1e-6, step=0.25, minStep=1e-3, maxSteps=50, maxTime=10.):
+    stats = {'nfev': 0, 'njev': 0, 'nit': 0, 'continuationSteps': 0}
+    targets = ramp_targets(assy)
+    if not targets:
+        return None, stats
+    start = time.perf_counter()
+    lam = 0.
+    xPrev, lamPrev = None, None
+    try:
+        set_homotopy(assy, targets, lam)
+        x, nit, ok = newton_stage(assy, np.asarray(x0, dtype=float), xtol, stats)
+        while ok and lam < 1.:
+            if stats['continuationSteps'] >= maxSteps or time.perf_counter() - start > maxTime:
+                ok = False
+                break
+            stats['continuationSteps'] += 1
+            lamNew = min(1., lam + step)
+            set_homotopy(assy, targets, lamNew)
+            if xPrev is None:
+                xNew, nit, okNew = newton_stage(assy, x, xtol, stats, 20)
+            else:
+                xGuess = x + (lamNew - lam) / (lam - lamPrev) * (x - xPrev)
+                xNew, nit, okNew = newton_stage(assy, xGuess, xtol, stats, 20)
+                if not okNew:
+                    xNew, nit, okNew = newton_stage(assy, x, xtol, stats, 20)
+            if okNew:
+                xPrev, lamPrev = x, lam
+                x, lam = xNew, lamNew
+                step = min(1., step * (2. if nit <= 4 else 1.2))
+            else:
+                step *= 0.5
+                if step < minStep:
+                    ok = False
+    finally:
+        for block, setter, easy, target in targets:
+            setter(target)
+        assy.refresh_params([t[0] for t in targets])
+    if ok:
+        assy.set_states_val(x)
+    return ok, stats
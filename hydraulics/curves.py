@@ -0,0 +1,163 @@
+from bisect import bisect_left, bisect_right
+import numpy as np
+import threading
+import functools
+import hashlib
+import weakref
+import math
+import os
+
+def sign(x):
+    return 1. if x > 0 else -1. if x < 0 else 0.
+
+def frozen_array(values):
+    if isinstance(values, np.ndarray) and values.dtype == float and not values.flags.writeable:
+        return values
+    values = np.array(values, dtype=float)
+    values.setflags(write=False)
+    return values
+
+class CurveTable:
+    def __init__(self, x, f, slopes=None):
+        self.x = frozen_array(x)
+        self.f = frozen_array(f)
+        if len(self.x) < 2 or len(self.x) != len(self.f):
+            raise Exception("Curve table shall have at least 2 points of equal length breakpoints and data.")
+        if slopes is None:
+            dx = np.diff(self.x)
+            df = np.diff(self.f)
+            slopes = np.divide(df, dx, out=np.zeros_like(df), where=dx != 0)
+        self.slopes = frozen_array(slopes)
+        dxLast = float(self.x[-1] - self.x[-2])
+        dfLast = float(self.f[-1] - self.f[-2])
+        self.slopeLast = dfLast / dxLast if dxLast else math.copysign(math.inf, dfLast) if dfLast else math.nan
+        self._n = len(self.x)
+
+    @functools.cached_property
+    def _x(self):
+        return self.x.tolist()
+
+    @functools.cached_property
+    def _f(self):
+        return self.f.tolist()
+
+    @functools.cached_property
+    def _slopes(self):
+        return self.slopes.tolist()
+
+    def interp(self, x):
+        xs = self._x
+        if x <= xs[0]:
+            return self._f[0]
+        if x >= xs[-1]:
+            return self._f[-1]
+        k = bisect_left(xs, x, 1, self._n - 1) - 1
+        return self._f[k] + (x - xs[k]) * self._slopes[k]
+
+    def slope(self, x):
+        xs = self._x
+        if x < xs[0] or x > xs[-1]:
+            return 0.
+        k = bisect_right(xs, x, 0, self._n - 1) - 1
+        return self._slopes[max(k, 0)]
+
+    def extrap(self, x):
+        return self._f[-2] + (x - self._x[-2]) * self.slopeLast
+
+    def interp_array(self, x):
+        x = np.asarray(x, dtype=float)
+        xc = np.clip(x, self.x[0], self.x[-1])
+        k = np.clip(np.searchsorted(self.x, xc, side='left') - 1, 0, self._n - 2)
+        return self.f[k] + (xc - self.x[k]) * self.slopes[k]
+
+    def slope_array(self, x):
+        x = np.asarray(x, dtype=float)
+        k = np.clip(np.searchsorted(self.x, x, side='right') - 1, 0, self._n - 2)
+        return np.where((x < self.x[0]) | (x > self.x[-1]), 0., self.slopes[k])
+
+    def extrap_array(self, x):
+        return self._f[-2] + (np.asarray(x, dtype=float) - self._x[-2]) * self.slopeLast
+
+    def scaled(self, xScale, fScale):
+        return CurveTable(xScale * self.x, fScale * self.f)
+
+
+class CurveRegistry:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._tables = weakref.WeakValueDictionary()
+        self._pinned = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tables)
+
+    @staticmethod
+    def table_key(x, f):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(len(x).to_bytes(8, 'little'))
+        h.update(x.tobytes())
+        h.update(f.tobytes())
+        return h.hexdigest()
+
+    def intern(self, x, f):
+        x = np.ascontiguousarray(x, dtype=float)
+        f = np.ascontiguousarray(f, dtype=float)
+        if x.ndim != 1 or x.shape != f.shape:
+            return CurveTable(x, f)
+        key = self.table_key(x, f)
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self.hits += 1
+                return table
+        table = CurveTable(x, f)
+        with self._lock:
+            self.misses += 1
+            return self._tables.setdefault(key, table)
+
+    def scaled(self, curve, xScale, fScale):
+        if xScale == 1 and fScale == 1:
+            return curve
+        return self.intern(xScale * curve.x, fScale * curve.f)
+
+    def export(self, path, tables=None):
+        if tables is None:
+            with self._lock:
+                tables = list(self._tables.values())
+        else:
+            tables = list({id(t): t for t in tables}.values())
+        parts = [np.concatenate(([len(t.x)], t.x, t.f, t.slopes)) for t in tables]
+        data = np.concatenate(parts) if parts else np.zeros(0)
+        tmpPath = f'{path}.{os.getpid()}.tmp'
+        with open(tmpPath, 'wb') as fh:
+            np.save(fh, data)
+        os.replace(tmpPath, path)
+        return len(tables)
+
+    def attach(self, path):
+        data = np.load(path, mmap_mode='r')
+        pos = 0
+        count = 0
+        while pos < len(data):
+            n = int(data[pos])
+            x = data[pos + 1:pos + 1 + n]
+            f = data[pos + 1 + n:pos + 1 + 2 * n]
+            slopes = data[pos + 1 + 2 * n:pos + 3 * n]
+            pos += 3 * n
+            key = self.table_key(x, f)
+            with self._lock:
+                table = self._tables.get(key)
+                if table is None:
+                    table = CurveTable(x, f, slopes)
+                    self._tables[key] = table
+                self._pinned[key] = table
+            count += 1
+        return count
+
+    def stats(self):
+        with self._lock:
+            return {'tables': len(self._tables), 'pinned': len(self._pinned), 'hits': self.hits, 'misses': self.misses}
+
+curveRegistry = CurveRegistry()
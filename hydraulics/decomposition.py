@@ -0,0 +1,178 @@
+from concurrent.futures import ThreadPoolExecutor
+from .solvers import newton_solve
+from scipy.sparse import csgraph
+from scipy import sparse
+import numpy as np
+
+def jacobian_pattern(assy, x):
+    x = np.asarray(x, dtype=float)
+    rng = np.random.default_rng(0)
+    xPert = x + rng.uniform(0.5, 1.5, len(x)) * np.maximum(np.abs(x), 1.) * 1e-3
+    pattern = None
+    for xi in (x, xPert):
+        J = sparse.csr_matrix(assy.qp_jacobian(xi))
+        J.eliminate_zeros()
+        J.data[:] = 1.
+        pattern = J if pattern is None else pattern + J
+    pattern.data[:] = 1.
+    return pattern
+
+def split_labels(labels):
+    order = np.argsort(labels, kind='stable')
+    bounds = np.flatnonzero(np.diff(labels[order])) + 1
+    return np.split(order, bounds)
+
+def connected_parts(pattern):
+    nEq, nVar = pattern.shape
+    graph = sparse.bmat([[None, pattern], [pattern.T, None]], format='csr')
+    nComp, labels = csgraph.connected_components(graph, directed=False)
+    parts = []
+    for members in split_labels(labels):
+        rows = members[members < nEq]
+        cols = members[members >= nEq] - nEq
+        parts.append((rows, cols))
+    return parts
+
+def triangular_blocks(pattern, rows, cols):
+    n = len(rows)
+    if n != len(cols) or n == 0:
+        return [(rows, cols)]
+    sub = pattern[rows][:, cols].tocsr()
+    match = csgraph.maximum_bipartite_matching(sub, perm_type='column')
+    if np.any(match < 0):
+        return [(rows, cols)]
+
+    rowOfCol = np.empty(n, dtype=int)
+    rowOfCol[match] = np.arange(n)
+    coo = sub.tocoo()
+    deps = sparse.csr_matrix((np.ones(coo.nnz), (coo.row, rowOfCol[coo.col])), shape=(n, n))
+    nScc, scc = csgraph.connected_components(deps, directed=True, connection='strong')
+
+    coo = deps.tocoo()
+    cross = scc[coo.row] != scc[coo.col]
+    edges = set(zip(scc[coo.col[cross]], scc[coo.row[cross]]))
+    successors = [[] for _ in range(nScc)]
+    nPred = np.zeros(nScc, dtype=int)
+    for before, after in edges:
+        successors[before].append(after)
+        nPred[after] += 1
+    ready = [s for s in range(nScc) if nPred[s] == 0]
+    members = split_labels(scc)
+    blocks = []
+    while ready:
+        s = ready.pop()
+        blocks.append((rows[members[s]], cols[match[members[s]]]))
+        for t in successors[s]:
+            nPred[t] -= 1
+            if nPred[t] == 0:
+                ready.append(t)
+    return blocks
+
+def decompose(assy, x):
+    pattern = jacobian_pattern(assy, x)
+    return [triangular_blocks(pattern, rows, cols) for rows, cols in connected_parts(pattern)]
+
+
+class BlockSubsystem:
+    def __init__(self, assy, eqBlocks, rows, cols):
+        self.blocks = [eqBlocks[i] for i in rows]
+        self.set_nodes(assy, cols)
+        colPos = {c: k for k, c in enumerate(cols)}
+        self.local = [[colPos.get(state.get_assyId()) for state in block.states] for block in self.blocks]
+
+    def set_nodes(self, assy, cols):
+        self.cols = cols
+        memberNodes = assy.get_memberNodes()
+        self.store = assy.store
+        self.repNodes = np.array([memberNodes[c][0] for c in cols], dtype=np.int64)
+        self.nodes = np.concatenate([memberNodes[c] for c in cols])
+        self.counts = [len(memberNodes[c]) for c in cols]
+
+    def get_values(self):
+        return self.store.value[self.repNodes]
+
+    def set_values(self, xs):
+        self.store.value[self.nodes] = np.repeat(xs, self.counts)
+
+    def qp_balance(self, xs):
+        self.set_values(xs)
+        return np.array([block.qp_balance() for block in self.blocks])
+
+    def qp_jacobian(self, xs):
+        self.set_values(xs)
+        rows = []
+        cols = []
+        data = []
+        for i, block in enumerate(self.blocks):
+            for k, d in zip(self.local[i], block.qp_jacobian()):
+                if k is not None:
+                    rows.append(i)
+                    cols.append(k)
+                    data.append(d)
+        return sparse.csr_matrix((data, (rows, cols)), shape=(len(self.blocks), len(self.cols)))
+
+    def solve(self, xtol=1e-6):
+        x, info, ok = newton_solve(self.qp_balance, self.qp_jacobian, self.get_values(), xtol=xtol)
+        self.set_values(x)
+        return ok, info
+
+
+class CompiledSubsystem(BlockSubsystem):
+    def __init__(self, assy, rows, cols):
+        self.set_nodes(assy, cols)
+        self.compiled = assy.compiled.subsystem(rows, cols)
+        extCols = self.compiled.extCols
+        isState = extCols < assy.nStates
+        memberNodes = assy.get_memberNodes()
+        constVal = self.compiled.constVal
+        constVal[isState] = self.store.value[[memberNodes[c][0] for c in extCols[isState].tolist()]]
+        constVal[~isState] = assy.compiled.constVal[extCols[~isState] - assy.nStates]
+
+    def qp_balance(self, xs):
+        return self.compiled.qp_balance(xs)
+
+    def qp_jacobian(self, xs):
+        return self.compiled.qp_jacobian(xs)
+
+
+minCompiledRows = 8
+residualTol = 1e-6
+
+def solve_component(assy, eqBlocks, blocks, xtol):
+    ok = True
+    stats = {'nfev': 0, 'njev': 0, 'nit': 0}
+    for rows, cols in blocks:
+        if len(rows) == 0 or len(cols) == 0:
+            continue
+        if assy.compiled is not None and len(rows) >= minCompiledRows:
+            subsystem = CompiledSubsystem(assy, rows, cols)
+        else:
+            subsystem = BlockSubsystem(assy, eqBlocks, rows, cols)
+        blockOk, info = subsystem.solve(xtol)
+        ok = ok and blockOk
+        for key in stats:
+            stats[key] += info[key]
+    return ok, stats
+
+def solve_decomposed(assy, x0, workers=None, xtol=1e-6):
+    components = decompose(assy, x0)
+    stats = {'nfev': 0, 'njev': 0, 'nit': 0, 'components': len(components),
+             'blocks': sum(len(blocks) for blocks in components)}
+    if len(components) == 1 and len(components[0]) == 1:
+        return None, stats
+    assy.set_states_val(x0)
+    eqBlocks = [block for block in assy.blocks.values() if block.qp_balance() is not None]
+    if workers is not None and workers > 1 and len(components) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda blocks: solve_component(assy, eqBlocks, blocks, xtol), components))
+    else:
+        results = [solve_component(assy, eqBlocks, blocks, xtol) for blocks in components]
+    for ok, info in results:
+        for key in ('nfev', 'njev', 'nit'):
+            stats[key] += info[key]
+    ok = all(ok for ok, info in results)
+    if ok:
+        x = np.asarray(assy.get_init_values(), dtype=float)
+        stats['nfev'] += 1
+        ok = bool(np.max(np.abs(assy.qp_balance(x)), initial=0.) <= residualTol * max(1., np.max(np.abs(x))))
+    return ok, stats
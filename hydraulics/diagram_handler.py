@@ -1,43 +1,62 @@
 from . import pumps, loads, joints, assembly
+from .cache import diagram_hash
+from .metrics import record_solve, cacheLookups
+from .results import numeric_result
+import functools
+import math
+import time
+import sys
 
-def create_pump(params):
-    flow = read_param_values(params, 'FlowRate', [0, 0])
-    pres = read_param_values(params, 'PressureHead', [0, 0])
-    speed = read_param_values(params, 'PumpSpeedPct', [0])[0]
+class DiagramError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        details = '; '.join(format_error(e) for e in errors[:5])
+        more = f' (+{len(errors) - 5} more)' if len(errors) > 5 else ''
+        super().__init__(f'Invalid diagram: {details}{more}')
+
+def format_error(error):
+    where = '.'.join(str(k) for k in (error.get('block'), error.get('field')) if k is not None)
+    return f"{where}: {error['message']}" if where else error['message']
+
+def create_pump(params, errors=None):
+    flow = read_param_values(params, 'FlowRate', [0, 0], errors)
+    pres = read_param_values(params, 'PressureHead', [0, 0], errors)
+    speed = read_param_values(params, 'PumpSpeedPct', [0], errors)[0]
     block = pumps.CentrifugalPump(flow, pres)
     block.set_speedPct(speed)
     return block
 
-def create_resi(params):
-    flow = read_param_values(params, 'FlowRate', [0, 0])
-    pres = read_param_values(params, 'PressureDrop', [0, 0])
+def create_resi(params, errors=None):
+    flow = read_param_values(params, 'FlowRate', [0, 0], errors)
+    pres = read_param_values(params, 'PressureDrop', [0, 0], errors)
     block = loads.HydraulicResistance(flow, pres)
     return block
 
-def create_valve(params):
-    flow = read_param_values(params, 'FlowRate', [0, 0])
-    pres = read_param_values(params, 'PressureDrop', [0, 0])
-    open = read_param_values(params, 'ValveOpeningPct', [0])[0]
+def create_valve(params, errors=None):
+    flow = read_param_values(params, 'FlowRate', [0, 0], errors)
+    pres = read_param_values(params, 'PressureDrop', [0, 0], errors)
+    open = read_param_values(params, 'ValveOpeningPct', [0], errors)[0]
     block = loads.HydraulicValve(flow, pres)
     block.set_openPct(open)
     return block
 
-def create_pipe(params):
-    d = read_param_values(params, 'InnerDiameter', [0])[0]
-    l = read_param_values(params, 'PipeLength', [0])[0]
-    block = loads.HydraulicPipe(d, l)
+def create_pipe(params, errors=None):
+    d = read_param_values(params, 'InnerDiameter', [0], errors)[0]
+    l = read_param_values(params, 'PipeLength', [0], errors)[0]
+    roughness = read_param_values(params, 'PipeRoughness', [None], errors)[0]
+    block = loads.HydraulicPipe(d, l, roughness)
     return block
 
-def create_split(params):
+def create_split(params, errors=None):
     block = joints.TeeSplit()
     return block
 
-def create_mixer(params):
+def create_mixer(params, errors=None):
     block = joints.TeeJoin()
     return block
 
-def create_reservoir(params):
-    pres = read_param_values(params, 'PressureConst', [0])[0]
+def create_reservoir(params, errors=None):
+    pres = read_param_values(params, 'PressureConst', [0], errors)[0]
     block = joints.HeaderTank(pres)
     return block
 
@@ -51,51 +70,129 @@ blockTypeDict = {
     'Reservoir':    {'n_in': 1, 'n_out': 1, 'createFunc': create_reservoir}
 }
 
-def create_block(blockType, params):
+def check_type(blockType):
     if blockType not in blockTypeDict:
-        raise Exception()
-    return blockTypeDict[blockType]['createFunc'](params)
+        raise Exception(f"Unknown block type {blockType}. Use one of {', '.join(blockTypeDict)}.")
+    return blockTypeDict[blockType]
 
-def read_param_values(params, key, default):
+def create_block(blockType, params, uid=None, errors=None):
+    blockErrors = []
+    block = None
     try:
-        text = params[key]
-        text = text.replace('[', '')
-        text = text.replace(']', '')
-        text = text.replace(';', ',')
-        textVals = text.split(',')
-        textVals = [t for t in textVals if t != '']
-        vals = list(map(float, textVals)) or default
+        createFunc = check_type(blockType)['createFunc']
+        if not isinstance(params, dict):
+            raise Exception("Block parameters shall be a JSON object.")
+        block = createFunc(params, blockErrors)
     except Exception as e:
-        print(f'Cannot read {key} parameter from the diagram data. Default value will be applied.')
-        vals = default
+        if not blockErrors:
+            blockErrors.append({'field': None, 'message': str(e)})
+    if blockErrors:
+        blockErrors = [{'block': uid, **e} for e in blockErrors]
+        if errors is None:
+            raise DiagramError(blockErrors)
+        errors.extend(blockErrors)
+        return None
+    return block
+
+numberTypes = (int, float)
+paramTextTable = str.maketrans({'[': None, ']': None, ';': ','})
+
+@functools.lru_cache(maxsize=4096)
+def parse_text(text):
+    return tuple(float(t) for t in text.translate(paramTextTable).split(',') if t.strip())
+
+def parse_values(value):
+    if isinstance(value, str):
+        vals = parse_text(value)
+    elif isinstance(value, numberTypes) and not isinstance(value, bool):
+        vals = (float(value),)
+    elif isinstance(value, list):
+        if not all(isinstance(v, numberTypes) and not isinstance(v, bool) for v in value):
+            raise ValueError("a list shall contain numbers only")
+        vals = tuple(float(v) for v in value)
+    else:
+        raise ValueError("use a number, a list of numbers or a comma separated string")
+    if not all(map(math.isfinite, vals)):
+        raise ValueError("values shall be finite numbers")
     return vals
 
-def read_connnection(blockType, conn):
-    if blockType not in blockTypeDict:
-        raise Exception()
-    src = conn['from'].split('.')
-    dst = conn['to'].split('.')
-    uid1 = src[0]
-    uid2 = dst[0]
-    port1 = int(src[1].replace('Outlet', '')) - 1 + blockTypeDict[blockType]['n_in']
-    port2 = int(dst[1].replace('Inlet', '')) - 1
-    return uid1, uid2, port1, port2
-
-def build_and_solve(diagramData):
-    uids = []
-    components = []
-    connections = []
-    for uid in diagramData:
-        uids.append(uid)
-        blockType = diagramData[uid]['type']
+def read_param_values(params, key, default, errors=None):
+    value = params.get(key)
+    if value is None:
+        return default
+    try:
+        vals = parse_values(value) or default
+    except ValueError as e:
+        message = f'Cannot read {value!r}: {e}'
+    else:
+        if len(default) == 1 and len(vals) != 1:
+            message = f'Expected a single value, got {len(vals)}.'
+        else:
+            return vals
+    if errors is None:
+        raise DiagramError([{'field': key, 'message': message}])
+    errors.append({'field': key, 'message': message})
+    return default
 
-        params = diagramData[uid]['parameters']
-        components.append(create_block(blockType, params))
+def read_port(portId, prefix, count):
+    uid, _, port = portId.rpartition('.') if isinstance(portId, str) else ('', '', '')
+    number = port[len(prefix):]
+    if not uid or not port.startswith(prefix) or not number.isdigit() or not 1 <= int(number) <= count:
+        raise Exception(f"Port {portId} shall be <block>.{prefix}N with N from 1 to {count}.")
+    return uid, int(number) - 1
 
-        conns = diagramData[uid]['connections']
+def read_connnection(blockType, conn, dstType=None):
+    if not isinstance(conn, dict):
+        raise Exception("Connection shall be a JSON object with from and to ports.")
+    srcInfo = check_type(blockType)
+    uid1, port1 = read_port(conn.get('from'), 'Outlet', srcInfo['n_out'])
+    uid2, port2 = read_port(conn.get('to'), 'Inlet', check_type(dstType)['n_in'] if dstType is not None else 2**31)
+    return uid1, uid2, port1 + srcInfo['n_in'], port2
+
+def parse_diagram(diagramData):
+    if not isinstance(diagramData, dict):
+        raise DiagramError([{'block': None, 'field': None, 'message': 'Diagram data shall be a JSON object of components.'}])
+    n = len(diagramData)
+    uids = list(diagramData)
+    components = [None] * n
+    connections = []
+    errors = []
+    usedPorts = set()
+    for i, uid in enumerate(uids):
+        comp = diagramData[uid]
+        if not isinstance(comp, dict):
+            errors.append({'block': uid, 'field': None, 'message': 'Component shall be a JSON object.'})
+            continue
+        blockType = comp.get('type')
+        components[i] = create_block(blockType, comp.get('parameters', {}), uid, errors)
+        if blockType not in blockTypeDict:
+            continue
+        conns = comp.get('connections', [])
+        if not isinstance(conns, list):
+            errors.append({'block': uid, 'field': 'connections', 'message': 'Connections shall be a list.'})
+            continue
         for conn in conns:
-            connections.append(read_connnection(blockType, conn))
+            try:
+                dst = conn.get('to') if isinstance(conn, dict) else None
+                dstUid = dst.rpartition('.')[0] if isinstance(dst, str) else None
+                dstComp = diagramData.get(dstUid)
+                if not isinstance(dstComp, dict) or dstComp.get('type') not in blockTypeDict:
+                    raise Exception(f"Connection target {dst} is not a valid block in the diagram.")
+                link = read_connnection(blockType, conn, dstComp['type'])
+                if link[0] != uid:
+                    raise Exception(f"Connection from {conn['from']} shall be listed under block {link[0]}.")
+                for port in ((link[0], link[2]), (link[1], link[3])):
+                    if port in usedPorts:
+                        raise Exception(f"Port of connection {conn['from']} -> {dst} is already connected.")
+                    usedPorts.add(port)
+                connections.append(link)
+            except Exception as e:
+                errors.append({'block': uid, 'field': 'connections', 'message': str(e)})
+    if errors:
+        raise DiagramError(errors)
+    return uids, components, connections
 
+def assemble(uids, components, connections):
     assy = assembly.HydraulicAssembly()
     for i, uid in enumerate(uids):
         assy.add_block(components[i], uid)
@@ -104,10 +201,25 @@ def build_and_solve(diagramData):
 
     if not assy.blocks:
         raise Exception('There are no blocks in the diagram.')
+    assy.finalize()
+    return assy
 
+def build_assembly(diagramData):
+    return assemble(*parse_diagram(diagramData))
+
+def solve_assembly(assy, warmStart=None, reduce=False):
     p0 = assy.get_avg_pressure()
-    assy.set_init_pressure(p0)
-    x, ok = assy.solve()
+    if warmStart:
+        assy.set_init_values(warmStart, p0)
+    else:
+        assy.set_init_pressure(p0)
+    assy.compile()
+    x, ok = assy.solve(method='decomposed', reduce=reduce)
+    return ok
+
+def build_and_solve(diagramData, warmStart=None):
+    assy = build_assembly(diagramData)
+    ok = solve_assembly(assy, warmStart)
     return get_port_states(assy), ok
 
 def get_port_states(assy):
@@ -122,18 +234,63 @@ def get_port_states(assy):
             states[portId] = f'Q={q:.2f}, P={p:.2f}'
     return states
 
-def run_solver(diagramData):
+def get_result(assy, resultFormat='text'):
+    if resultFormat == 'numeric':
+        return numeric_result(assy)
+    if resultFormat != 'text':
+        raise Exception(f"Unknown result format {resultFormat}. Use 'text' or 'numeric'.")
+    return get_port_states(assy)
+
+def run_solver(diagramData, warmStarts=None, warmKey=None, resultFormat='text', reduce=False):
     status = 'fail'
     message = ''
     result = {}
+    metrics = {}
     try:
-        result, ok = build_and_solve(diagramData)
+        warmStart = warmStarts.get(warmKey) if warmStarts is not None else None
+        start = time.perf_counter()
+        parsed = parse_diagram(diagramData)
+        metrics['parseTime'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        assy = assemble(*parsed)
+        metrics['buildTime'] = time.perf_counter() - start
+        metrics['nBlocks'] = len(assy.blocks)
+        metrics['nStates'] = assy.nStates
+
+        ok = solve_assembly(assy, warmStart, reduce)
+        metrics.update(assy.solveInfo)
+        result = get_result(assy, resultFormat)
         if ok:
             status = 'success'
+            if warmStarts is not None:
+                warmStarts.put(warmKey, assy.states_to_dict(merged=True))
         else:
             status = 'marginal'
+    except DiagramError as e:
+        status, message, result = 'invalid', str(e), {'errors': e.errors}
     except Exception as e:
         message = str(e)
-        print('Error in hydraulics model or solver: ' + message)
+        print('Error in hydraulics model or solver: ' + message, file=sys.stderr)
+
+    record_solve(status, metrics, diagramData)
+    return status, message, result, metrics
+
+cacheableStatus = ('success', 'marginal', 'invalid')
 
-    return status, message, result
+def run_solver_cached(diagramData, cache, warmStarts=None, warmKey=None, resultFormat='text', reduce=False):
+    if not isinstance(diagramData, dict):
+        return run_solver(diagramData, resultFormat=resultFormat, reduce=reduce)
+    key = diagram_hash(diagramData)
+    if resultFormat != 'text':
+        key += '.' + resultFormat
+    cached = cache.get(key)
+    if cached is not None:
+        cacheLookups.inc(result='hit')
+        status, message, result, metrics = cached
+        return status, message, result, dict(metrics, cached=True)
+    cacheLookups.inc(result='miss')
+    status, message, result, metrics = run_solver(diagramData, warmStarts, warmKey, resultFormat, reduce)
+    if status in cacheableStatus:
+        cache.put(key, (status, message, result, metrics))
+    return status, message, result, metrics
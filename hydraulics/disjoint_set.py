@@ -0,0 +1,46 @@
+import numpy as np
+
+class DisjointSet:
+    def __init__(self):
+        self.parent = []
+        self.rank = []
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add(self):
+        i = len(self.parent)
+        self.parent.append(i)
+        self.rank.append(0)
+        return i
+
+    def reset(self, i):
+        self.parent[i] = i
+        self.rank[i] = 0
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        i = self.find(i)
+        j = self.find(j)
+        if i == j:
+            return i
+        if self.rank[i] < self.rank[j]:
+            i, j = j, i
+        self.parent[j] = i
+        if self.rank[i] == self.rank[j]:
+            self.rank[i] += 1
+        return i
+
+    def roots(self):
+        parent = np.array(self.parent, dtype=np.int64)
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                return parent
+            parent = grand
@@ -0,0 +1,40 @@
+import numpy as np
+
+laminarRe = 2000.
+turbulentRe = 4000.
+
+def blasius(Re):
+    g = 0.3164 * Re ** 0.75
+    return g, 0.75 * g / Re
+
+def swamee_jain(Re, relRough):
+    a = relRough / 3.7
+    b = 5.74 * Re ** -0.9
+    lg = np.log10(a + b)
+    lm = 0.25 / lg ** 2
+    dlg = -0.9 * b / (Re * (a + b) * np.log(10.))
+    dlm = -2. * lm / lg * dlg
+    return lm * Re, lm + Re * dlm
+
+def turbulent(Re, relRough=None):
+    if relRough is None:
+        return blasius(Re)
+    rough = ~np.isnan(relRough)
+    if np.all(rough):
+        return swamee_jain(Re, relRough)
+    g, dg = blasius(Re)
+    if np.any(rough):
+        gr, dgr = swamee_jain(Re, np.where(rough, relRough, 0.))
+        g = np.where(rough, gr, g)
+        dg = np.where(rough, dgr, dg)
+    return g, dg
+
+def friction_re(Re, relRough=None):
+    gt, dgt = turbulent(np.maximum(Re, laminarRe), relRough)
+    width = turbulentRe - laminarRe
+    t = np.clip((Re - laminarRe) / width, 0., 1.)
+    w = t * t * (3. - 2. * t)
+    dw = 6. * t * (1. - t) / width
+    g = 64. + w * (gt - 64.)
+    dg = w * dgt + dw * (gt - 64.)
+    return g, dg
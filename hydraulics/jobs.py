@@ -0,0 +1,263 @@
+from multiprocessing.connection import wait
+from collections import OrderedDict, deque
+from .cache import diagram_hash
+from .diagram_handler import cacheableStatus
+from .metrics import record_solve
+import multiprocessing
+import threading
+import sys
+import secrets
+import time
+import os
+
+def _worker_main(conn):
+    from .diagram_handler import run_solver
+    while True:
+        try:
+            diagramData = conn.recv()
+        except EOFError:
+            break
+        if diagramData is None:
+            break
+        conn.send(run_solver(diagramData))
+
+
+def worker_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class SolveJob:
+    def __init__(self, key, diagramData, timeout):
+        self.id = secrets.token_urlsafe(12)
+        self.key = key
+        self.diagramData = diagramData
+        self.timeout = timeout
+        self.status = 'queued'
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.version = 0
+        self.cancelRequested = False
+
+    def is_done(self):
+        return self.status in ('done', 'cancelled', 'timeout', 'error')
+
+    def to_dict(self):
+        info = {'jobId': self.id,
+                'status': self.status,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished}
+        if self.result is not None:
+            status, message, result, metrics = self.result
+            info.update({'solverStatus': status, 'message': message, 'result': result, 'metrics': metrics})
+        return info
+
+
+class SolverProcess:
+    def __init__(self, context):
+        self.conn, childConn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(childConn,), daemon=True)
+        self.process.start()
+        childConn.close()
+        self.job = None
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join(1.)
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(1.)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class JobQueue:
+    def __init__(self, maxWorkers=None, timeout=60., maxQueued=1000, keepFinished=600., cache=None):
+        self.maxWorkers = maxWorkers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.maxQueued = maxQueued
+        self.keepFinished = keepFinished
+        self.cache = cache
+        self.jobs = OrderedDict()
+        self._active = dict()
+        self._queue = deque()
+        self._workers = []
+        self._context = worker_context()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def submit(self, diagramData, timeout=None):
+        key = diagram_hash(diagramData)
+        with self._cond:
+            if self._closed:
+                raise Exception("Job queue is shut down.")
+            if key in self._active:
+                return self._active[key]
+            job = SolveJob(key, diagramData, timeout or self.timeout)
+            self.jobs[job.id] = job
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                self._finish(job, 'done', cached)
+                return job
+            if len(self._queue) >= self.maxQueued:
+                del self.jobs[job.id]
+                raise Exception("Too many queued jobs. Try again later.")
+            self._active[key] = job
+            self._queue.append(job)
+            self._start()
+            self._cond.notify_all()
+            return job
+
+    def get(self, jobId):
+        with self._cond:
+            self._purge()
+            return self.jobs.get(jobId)
+
+    def cancel(self, jobId):
+        with self._cond:
+            job = self.jobs.get(jobId)
+            if job is None or job.is_done():
+                return job
+            if job.status == 'queued':
+                self._queue.remove(job)
+                self._finish(job, 'cancelled')
+            else:
+                job.cancelRequested = True
+                self._cond.notify_all()
+            return job
+
+    def wait_update(self, job, version, timeout=None):
+        with self._cond:
+            self._cond.wait_for(lambda: job.version != version, timeout)
+            return job.version
+
+    def stats(self):
+        with self._cond:
+            return {'queued': len(self._queue),
+                    'running': sum(1 for w in self._workers if w.job is not None),
+                    'workers': len(self._workers),
+                    'maxWorkers': self.maxWorkers,
+                    'jobs': len(self.jobs)}
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='hydrui-jobs', daemon=True)
+            self._thread.start()
+
+    def _finish(self, job, status, result=None):
+        job.status = status
+        job.result = result
+        job.finished = time.time()
+        job.diagramData = None
+        job.version += 1
+        if self._active.get(job.key) is job:
+            del self._active[job.key]
+        self._cond.notify_all()
+
+    def _purge(self):
+        now = time.time()
+        for jobId in [j.id for j in self.jobs.values() if j.is_done() and now - j.finished > self.keepFinished]:
+            del self.jobs[jobId]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    break
+                self._dispatch()
+                busy = [w for w in self._workers if w.job is not None]
+                if not busy:
+                    self._cond.wait(1.)
+                    continue
+            ready = wait([w.conn for w in busy], timeout=0.05)
+            with self._cond:
+                for worker in busy:
+                    if worker.conn in ready:
+                        self._collect(worker)
+                    elif worker.job is not None:
+                        self._check(worker)
+
+        with self._cond:
+            for worker in self._workers:
+                if worker.job is not None:
+                    worker.kill()
+                    self._finish(worker.job, 'cancelled')
+                else:
+                    worker.stop()
+            self._workers = []
+            for job in self._queue:
+                self._finish(job, 'cancelled')
+            self._queue.clear()
+
+    def _dispatch(self):
+        while self._queue:
+            worker = next((w for w in self._workers if w.job is None), None)
+            if worker is None and len(self._workers) >= self.maxWorkers:
+                return
+            job = self._queue.popleft()
+            try:
+                if worker is None:
+                    worker = SolverProcess(self._context)
+                    self._workers.append(worker)
+                worker.conn.send(job.diagramData)
+            except Exception as e:
+                message = 'Error in starting solver process: ' + str(e)
+                print(message, file=sys.stderr)
+                if worker is not None:
+                    self._discard(worker)
+                self._finish(job, 'error', ('fail', message, {}, {}))
+                continue
+            worker.job = job
+            job.status = 'running'
+            job.started = time.time()
+            job.version += 1
+            self._cond.notify_all()
+
+    def _collect(self, worker):
+        job = worker.job
+        worker.job = None
+        try:
+            result = worker.conn.recv()
+        except (EOFError, OSError):
+            self._discard(worker)
+            self._finish(job, 'error', ('fail', 'Solver process terminated unexpectedly.', {}, {}))
+            return
+        record_solve(result[0], result[3])
+        if self.cache is not None and result[0] in cacheableStatus:
+            self.cache.put(job.key, result)
+        self._finish(job, 'done', result)
+
+    def _check(self, worker):
+        job = worker.job
+        if job.cancelRequested:
+            status = 'cancelled'
+        elif time.time() - job.started > job.timeout:
+            status = 'timeout'
+        elif not worker.process.is_alive():
+            status = 'error'
+        else:
+            return
+        worker.job = None
+        self._discard(worker)
+        self._finish(job, status)
+
+    def _discard(self, worker):
+        worker.kill()
+        self._workers.remove(worker)
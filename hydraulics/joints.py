@@ -8,14 +8,20 @@ class HeaderTank(HydraulicBlock):
         self.statesConst = [self.states[1]]
         self.ports = [BlockPort('inlet', 0, 1),
                       BlockPort('outlet', 0, 1)]
-        self._set_pConst(pressure)
+        self.set_pConst(pressure)
 
-    def _set_pConst(self, pressure):
+    def set_pConst(self, pressure):
         self.states[1].value = pressure
 
+    def get_pConst(self):
+        return self.states[1].value
+
     def qp_balance(self):
         return None
 
+    def qp_jacobian(self):
+        return None
+
 class TeeSplit(HydraulicBlock):
     def __init__(self):
         super().__init__(1, 2)
@@ -33,6 +39,9 @@ class TeeSplit(HydraulicBlock):
         q_out2 = self.states[2].value
         return q_in - q_out1 - q_out2
 
+    def qp_jacobian(self):
+        return [1., -1., -1., 0.]
+
 
 class TeeJoin(HydraulicBlock):
     def __init__(self):
@@ -51,6 +60,9 @@ class TeeJoin(HydraulicBlock):
         q_out = self.states[2].value
         return q_in1 + q_in2 - q_out
 
+    def qp_jacobian(self):
+        return [1., 1., -1., 0.]
+
 class MultiPortJoint(HydraulicBlock):
     def __init__(self, n_in=1, n_out=1):
         super().__init__(n_in, n_out)
@@ -71,3 +83,6 @@ class MultiPortJoint(HydraulicBlock):
         for i in range(self.n_out):
             qDiff -= self.states[self.n_in + i].value
         return qDiff
+
+    def qp_jacobian(self):
+        return [1.] * self.n_in + [-1.] * self.n_out + [0.]
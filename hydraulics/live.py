@@ -0,0 +1,191 @@
+from collections import defaultdict
+from .diagram_handler import parse_diagram, assemble, create_block, read_connnection, read_param_values, \
+    get_result, DiagramError
+from .results import DeltaEncoder
+from .sweep import paramSetters
+from .metrics import record_solve
+import threading
+import copy
+import time
+import sys
+
+class LiveDiagram:
+    def __init__(self, diagramData, version=0):
+        self.diagramData = copy.deepcopy(diagramData)
+        self.assy = assemble(*parse_diagram(self.diagramData))
+        self.version = version
+        self.cond = threading.Condition()
+        self.latest = 0
+        self.solved = False
+        self.deltaEncoder = DeltaEncoder()
+        self._incoming = defaultdict(set)
+        self._seqLock = threading.Lock()
+        for uid, comp in self.diagramData.items():
+            comp.setdefault('parameters', {})
+            for conn in comp.setdefault('connections', []):
+                self._incoming[conn['to'].rpartition('.')[0]].add(uid)
+
+    def supersede(self, seq):
+        if seq is not None:
+            with self._seqLock:
+                self.latest = max(self.latest, seq)
+
+    def is_superseded(self, seq):
+        return seq is not None and seq < self.latest
+
+    def wait_version(self, version, timeout):
+        self.cond.wait_for(lambda: self.version >= version, timeout)
+        return self.version == version
+
+    def read_link(self, conn):
+        uid = conn['from'].rpartition('.')[0]
+        if uid not in self.diagramData:
+            raise Exception(f"Unknown block {uid} in connection {conn['from']} -> {conn['to']}.")
+        return read_connnection(self.diagramData[uid]['type'], conn)
+
+    def apply(self, diff):
+        assy = self.assy
+        for conn in diff.get('disconnect', []):
+            assy.disconnect_blocks(*self.read_link(conn))
+            src = conn['from'].rpartition('.')[0]
+            conns = self.diagramData[src]['connections']
+            conns[:] = [c for c in conns if (c['from'], c['to']) != (conn['from'], conn['to'])]
+
+        for uid in diff.get('remove', []):
+            assy.remove_block(uid)
+            for src in self._incoming.pop(uid, ()):
+                if src in self.diagramData:
+                    conns = self.diagramData[src]['connections']
+                    conns[:] = [c for c in conns if c['to'].rpartition('.')[0] != uid]
+            for conn in self.diagramData.pop(uid)['connections']:
+                self._incoming[conn['to'].rpartition('.')[0]].discard(uid)
+
+        added = diff.get('add', {})
+        for uid, comp in added.items():
+            comp = {'type': comp['type'], 'parameters': dict(comp.get('parameters', {})), 'connections': []}
+            assy.add_block(create_block(comp['type'], comp['parameters'], uid), uid)
+            self.diagramData[uid] = comp
+
+        conns = [c for comp in added.values() for c in comp.get('connections', [])]
+        for conn in conns + list(diff.get('connect', [])):
+            assy.connect_blocks(*self.read_link(conn))
+            src = conn['from'].rpartition('.')[0]
+            self.diagramData[src]['connections'].append({'from': conn['from'], 'to': conn['to']})
+            self._incoming[conn['to'].rpartition('.')[0]].add(src)
+
+        changed = []
+        for uid, params in diff.get('parameters', {}).items():
+            if uid not in assy.blocks:
+                raise Exception(f"Cannot change parameters. Block {uid} is not in the diagram.")
+            comp = self.diagramData[uid]
+            comp['parameters'].update(params)
+            block = assy.blocks[uid]
+            setters = [paramSetters.get(name) for name in params]
+            if all(setter is not None and hasattr(block, setter) for setter in setters):
+                errors = []
+                values = [read_param_values(comp['parameters'], name, [0], errors)[0] for name in params]
+                if errors:
+                    raise DiagramError([{'block': uid, **e} for e in errors])
+                for value, setter in zip(values, setters):
+                    getattr(block, setter)(value)
+                changed.append(block)
+            else:
+                assy.replace_block(uid, create_block(comp['type'], comp['parameters'], uid))
+        if changed:
+            assy.refresh_params(changed)
+
+        if not assy.blocks:
+            raise Exception('There are no blocks in the diagram.')
+        assy.finalize()
+        self.version += 1
+
+    def solve(self, resultFormat='text'):
+        assy = self.assy
+        metrics = {'nBlocks': len(assy.blocks), 'nStates': assy.nStates, 'warm': self.solved}
+        if assy.compiled is None:
+            start = time.perf_counter()
+            assy.compile()
+            metrics['buildTime'] = time.perf_counter() - start
+        if not self.solved:
+            assy.set_init_pressure(assy.get_avg_pressure())
+        x, ok = assy.solve(method='decomposed')
+        if not ok and self.solved:
+            assy.set_init_pressure(assy.get_avg_pressure())
+            x, ok = assy.solve(method='decomposed')
+            metrics['warm'] = False
+        self.solved = self.solved or ok
+        metrics.update(assy.solveInfo)
+        return ('success' if ok else 'marginal'), get_result(assy, resultFormat), metrics
+
+
+def acquire_session(sessions, key, version, wait):
+    if not isinstance(version, int):
+        return None
+    deadline = time.monotonic() + wait
+    while True:
+        live = sessions.get(key)
+        if live is None:
+            return None
+        live.cond.acquire()
+        if live.wait_version(version, max(0., min(0.05, deadline - time.monotonic()))):
+            return live
+        live.cond.release()
+        if live.version > version or time.monotonic() >= deadline:
+            return None
+
+def run_live(sessions, key, diagramData=None, diff=None, version=None, seq=None, resultFormat='text',
+             delta=False, tol=1e-4, deltaBase=None, wait=2.):
+    status = 'fail'
+    message = ''
+    result = {}
+    metrics = {}
+    try:
+        start = time.perf_counter()
+        if diagramData is not None:
+            live = LiveDiagram(diagramData, version or 0)
+            live.supersede(seq)
+            previous = sessions.get(key)
+            if previous is not None:
+                previous.supersede(seq)
+            sessions.put(key, live)
+            live.cond.acquire()
+            metrics['parseTime'] = time.perf_counter() - start
+        else:
+            current = sessions.get(key)
+            if current is not None:
+                current.supersede(seq)
+            live = acquire_session(sessions, key, version, wait)
+            if live is None:
+                return 'resync', 'The live diagram is missing or out of date. Send the full diagram.', {}, {}
+        try:
+            if diff:
+                start = time.perf_counter()
+                try:
+                    live.apply(diff)
+                except Exception:
+                    sessions.drop(key)
+                    raise
+                finally:
+                    live.cond.notify_all()
+                metrics['diffTime'] = time.perf_counter() - start
+            metrics['version'] = live.version
+            if live.is_superseded(seq):
+                status = 'superseded'
+                message = 'A newer live request replaced this one.'
+            else:
+                status, result, solveMetrics = live.solve(resultFormat)
+                metrics.update(solveMetrics)
+                if delta:
+                    result = live.deltaEncoder.encode(result, tol, deltaBase)
+                else:
+                    live.deltaEncoder.reset()
+        finally:
+            live.cond.release()
+    except DiagramError as e:
+        status, message, result = 'invalid', str(e), {'errors': e.errors}
+    except Exception as e:
+        message = str(e)
+        print('Error in hydraulics model or solver: ' + message, file=sys.stderr)
+
+    record_solve(status, metrics)
+    return status, message, result, metrics
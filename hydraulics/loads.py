@@ -1,4 +1,6 @@
 from .block import HydraulicQuantity, BlockState, BlockPort, HydraulicBlock
+from .curves import curveRegistry, sign
+from .friction import friction_re
 import numpy as np
 
 class HydraulicResistance(HydraulicBlock):
@@ -13,17 +15,30 @@ class HydraulicResistance(HydraulicBlock):
                        BlockState(HydraulicQuantity.P, 'p_out')]
         self.ports = [BlockPort('inlet', 0, 1),
                       BlockPort('outlet', 0, 2)]
-        self.qData = np.array(q)
-        self.pData = np.array(p)
+        self.curve = curveRegistry.intern(q, p)
+        self.qLast = float(self.curve.x[-1])
+
+    @property
+    def qData(self):
+        return self.curve.x
+
+    @property
+    def pData(self):
+        return self.curve.f
 
     def qp_lut(self, q):
+        s = sign(q)
+        q = abs(q)
+        if q <= self.qLast:
+            return s * self.curve.interp(q)
+        else:
+            return s * self.curve.extrap(q)
+
+    def qp_lut_array(self, q):
+        q = np.asarray(q, dtype=float)
         s = np.sign(q)
         q = np.abs(q)
-        if q <= self.qData[-1]:
-            return s * np.interp(q, self.qData, self.pData)
-        else:
-            return s * (self.pData[-2] + (q - self.qData[-2]) * (self.pData[-1] - self.pData[-2]) /
-                                                                (self.qData[-1] - self.qData[-2]))
+        return s * np.where(q <= self.qLast, self.curve.interp_array(q), self.curve.extrap_array(q))
 
     def qp_balance(self):
         q = self.states[0].value
@@ -34,6 +49,17 @@ class HydraulicResistance(HydraulicBlock):
     def qp_balance_aux(self, q, p_in, p_out):
         return p_in - p_out - self.qp_lut(q)
 
+    def qp_lut_slope(self, q):
+        q = abs(q)
+        if q <= self.qLast:
+            return self.curve.slope(q)
+        else:
+            return self.curve.slopeLast
+
+    def qp_jacobian(self):
+        q = self.states[0].value
+        return [-self.qp_lut_slope(q), 1., -1.]
+
 
 class HydraulicValve(HydraulicBlock):
     def __init__(self, q, p):
@@ -47,25 +73,38 @@ class HydraulicValve(HydraulicBlock):
                        BlockState(HydraulicQuantity.P, 'p_out')]
         self.ports = [BlockPort('inlet', 0, 1),
                       BlockPort('outlet', 0, 2)]
-        self.qData = np.array(q)
-        self.pData = np.array(p)
-        self._openPct = 0
+        self.curve = curveRegistry.intern(p, q)
+        self.pLast = float(self.curve.x[-1])
+        self.set_openPct(0)
+
+    @property
+    def qData(self):
+        return self.curve.f
+
+    @property
+    def pData(self):
+        return self.curve.x
 
     def set_openPct(self, opening):
         self._openPct = opening
+        self._openFrac = opening / 100.
 
     def get_openPct(self):
         return self._openPct
 
     def pq_lut(self, p):
+        s = sign(p)
+        p = abs(p)
+        if p <= self.pLast:
+            return s * self._openFrac * self.curve.interp(p)
+        else:
+            return s * self._openFrac * self.curve.extrap(p)
+
+    def pq_lut_array(self, p):
+        p = np.asarray(p, dtype=float)
         s = np.sign(p)
         p = np.abs(p)
-        openFrac = self._openPct / 100.
-        if p <= self.pData[-1]:
-            return s * openFrac * np.interp(p, self.pData, self.qData)
-        else:
-            return s * openFrac * (self.qData[-2] + (p - self.pData[-2]) * (self.qData[-1] - self.qData[-2]) /
-                                                                           (self.pData[-1] - self.pData[-2]))
+        return s * self._openFrac * np.where(p <= self.pLast, self.curve.interp_array(p), self.curve.extrap_array(p))
 
     def qp_balance(self):
         q = self.states[0].value
@@ -76,13 +115,28 @@ class HydraulicValve(HydraulicBlock):
     def qp_balance_aux(self, q, p_in, p_out):
         return q - self.pq_lut(p_in - p_out)
 
+    def pq_lut_slope(self, p):
+        p = abs(p)
+        if p <= self.pLast:
+            return self._openFrac * self.curve.slope(p)
+        else:
+            return self._openFrac * self.curve.slopeLast
+
+    def qp_jacobian(self):
+        p_in = self.states[1].value
+        p_out = self.states[2].value
+        dqdp = self.pq_lut_slope(p_in - p_out)
+        return [1., -dqdp, dqdp]
+
 
 class HydraulicPipe(HydraulicBlock):
-    def __init__(self, d, l):
+    def __init__(self, d, l, roughness=None):
         if d <= 0:
             raise Exception("Pipe diameter shall be positive.")
         if l < 0:
             raise Exception("Pipe length shall be non-negative.")
+        if roughness is not None and roughness < 0:
+            raise Exception("Pipe roughness shall be non-negative.")
         super().__init__(1, 1)
         self.states = [BlockState(HydraulicQuantity.Q, 'q'),
                        BlockState(HydraulicQuantity.P, 'p_in'),
@@ -91,18 +145,56 @@ class HydraulicPipe(HydraulicBlock):
                       BlockPort('outlet', 0, 2)]
         self.d = d
         self.l = l
+        self.roughness = roughness
         self.rho = 1000
         self.eta = 0.9e-3
+        self.update_constants()
+
+    def set_diameter(self, d):
+        if d <= 0:
+            raise Exception("Pipe diameter shall be positive.")
+        self.d = d
+        self.update_constants()
+
+    def get_diameter(self):
+        return self.d
+
+    def set_length(self, l):
+        if l < 0:
+            raise Exception("Pipe length shall be non-negative.")
+        self.l = l
+        self.update_constants()
+
+    def get_length(self):
+        return self.l
+
+    def update_constants(self):
+        self.area = 0.25 * np.pi * self.d ** 2
+        dvdq = 1e-3 / 60. / self.area
+        self.reCoef = dvdq * self.d * self.rho / self.eta
+        self.dpCoef = 0.5e-3 * self.rho * self.l / self.d * dvdq ** 2 / self.reCoef
+        self.relRough = None if self.roughness is None else self.roughness / self.d
+
+    def qp_lut(self, q):
+        g, dg = friction_re(self.reCoef * abs(q), self.relRough)
+        return self.dpCoef * float(g) * q
+
+    def qp_lut_array(self, q):
+        q = np.asarray(q, dtype=float)
+        g, dg = friction_re(self.reCoef * np.abs(q), self.relRough)
+        return self.dpCoef * g * q
+
+    def qp_lut_slope(self, q):
+        Re = self.reCoef * abs(q)
+        g, dg = friction_re(Re, self.relRough)
+        return self.dpCoef * float(g + Re * dg)
 
     def qp_balance(self):
         q = self.states[0].value
         p_in = self.states[1].value
         p_out = self.states[2].value
-        v = np.abs(q) * 1e-3 / 60. / (0.25 * np.pi * self.d ** 2)
-        Re = v * self.d * self.rho / self.eta
-        if Re < 2300:
-            lm = 64. / max(Re, 1e-6)
-        else:
-            lm = 0.3164 / np.power(max(Re, 1e-6), 0.25)
-        k = 1e-3 * lm * self.rho * self.l / self.d
-        return p_in - p_out - np.sign(q) * 0.5 * k * v ** 2
+        return p_in - p_out - self.qp_lut(q)
+
+    def qp_jacobian(self):
+        dpdq = self.qp_lut_slope(self.states[0].value)
+        return [-dpdq, 1., -1.]
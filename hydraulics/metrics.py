@@ -0,0 +1,131 @@
+from collections import defaultdict
+import threading
+import math
+import sys
+
+class Counter:
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1., **labels):
+        key = tuple(labels.get(k, '') for k in self.labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def get(self, **labels):
+        return self._values.get(tuple(labels.get(k, '') for k in self.labels), 0.)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{format_labels(self.labels, key)} {format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, doc, buckets, labels=()):
+        self.name = name
+        self.doc = doc
+        self.buckets = sorted(buckets)
+        self.labels = tuple(labels)
+        self._counts = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self._sums = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(k, '') for k in self.labels)
+        with self._lock:
+            counts = self._counts[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._sums[key] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, counts in sorted(self._counts.items()):
+                for bound, count in zip(self.buckets + [math.inf], counts):
+                    le = format_value(bound)
+                    lines.append(f'{self.name}_bucket{format_labels(self.labels + ("le",), key + (le,))} {count}')
+                lines.append(f'{self.name}_sum{format_labels(self.labels, key)} {format_value(self._sums[key])}')
+                lines.append(f'{self.name}_count{format_labels(self.labels, key)} {counts[-1]}')
+        return lines
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, values)) + '}'
+
+def format_value(value):
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.hooks = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def render(self, extra=()):
+        lines = []
+        for metric in list(self.metrics) + list(extra):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+timeBuckets = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.]
+countBuckets = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+registry = MetricsRegistry()
+solvesTotal = registry.register(Counter('hydrui_solves_total', 'Solver runs by final status.', ['status']))
+phaseSeconds = registry.register(Histogram('hydrui_solve_phase_seconds', 'Time spent per solve phase.',
+                                           timeBuckets, ['phase']))
+functionEvals = registry.register(Histogram('hydrui_solver_function_evaluations',
+                                            'Residual evaluations per solve.', countBuckets))
+jacobianEvals = registry.register(Histogram('hydrui_solver_jacobian_evaluations',
+                                            'Jacobian evaluations per solve.', countBuckets))
+cacheLookups = registry.register(Counter('hydrui_result_cache_lookups_total', 'Result cache lookups.',
+                                        ['result']))
+planLookups = registry.register(Counter('hydrui_plan_cache_lookups_total',
+                                       'Compiled topology plan lookups by source.', ['result']))
+residualNorm = registry.register(Histogram('hydrui_solver_residual_norm', 'Final residual norm per solve.',
+                                           [1e-12, 1e-9, 1e-6, 1e-3, 1., 1e3]))
+
+def record_solve(status, metrics, diagramData=None):
+    solvesTotal.inc(status=status)
+    for phase in ('parse', 'build', 'solve'):
+        if f'{phase}Time' in metrics:
+            phaseSeconds.observe(metrics[f'{phase}Time'], phase=phase)
+    if 'nfev' in metrics:
+        functionEvals.observe(metrics['nfev'])
+    if 'njev' in metrics:
+        jacobianEvals.observe(metrics['njev'])
+    if metrics.get('residualNorm') is not None:
+        residualNorm.observe(metrics['residualNorm'])
+    for hook in list(registry.hooks):
+        try:
+            hook(status, metrics, diagramData)
+        except Exception as e:
+            print('Error in solver profiling hook: ' + str(e), file=sys.stderr)
@@ -1,4 +1,5 @@
 from .block import HydraulicQuantity, BlockState, BlockPort, HydraulicBlock
+from .curves import curveRegistry
 import numpy as np
 
 class CentrifugalPump(HydraulicBlock):
@@ -13,27 +14,50 @@ class CentrifugalPump(HydraulicBlock):
                        BlockState(HydraulicQuantity.P,'p_out')]
         self.ports = [BlockPort('inlet', 0, 1),
                       BlockPort('outlet', 0, 2)]
-        self.qData = np.array(q)
-        self.pData = np.array(p)
-        self._speedPct = 0
+        self.curve = curveRegistry.intern(q, p)
+        self.set_speedPct(0)
+
+    @property
+    def qData(self):
+        return self.curve.x
+
+    @property
+    def pData(self):
+        return self.curve.f
 
     def set_speedPct(self, speed):
         self._speedPct = speed
+        speedFrac = speed / 100.
+        self._speedFrac = speedFrac
+        self.qLast = float(self.curve.x[-1])
+        self.lut = curveRegistry.scaled(self.curve, speedFrac, speedFrac**2)
 
     def get_speedPct(self):
         return self._speedPct
 
     def qp_lut(self, q):
-        if self._speedPct == 0:
+        if self._speedFrac == 0:
             return 0
         if q < 0:
             q = 0
-        speedFrac = self._speedPct / 100.
-        if q <= self.qData[-1]:
-            return np.interp(q, speedFrac * self.qData, speedFrac**2 * self.pData)
+        if q <= self.qLast:
+            return self.lut.interp(q)
         else:
-            return (speedFrac**2 * self.pData[-2] + (q - speedFrac * self.qData[-2]) * speedFrac *
-                    (self.pData[-1] - self.pData[-2]) / (self.qData[-1] - self.qData[-2]))
+            return self.lut.extrap(q)
+
+    def qp_lut_array(self, q):
+        q = np.maximum(np.asarray(q, dtype=float), 0)
+        if self._speedFrac == 0:
+            return np.zeros_like(q)
+        return np.where(q <= self.qLast, self.lut.interp_array(q), self.lut.extrap_array(q))
+
+    def qp_lut_slope(self, q):
+        if self._speedFrac == 0 or q < 0:
+            return 0.
+        if q <= self.qLast:
+            return self.lut.slope(q)
+        else:
+            return self.lut.slopeLast
 
     def qp_balance(self):
         q = self.states[0].value
@@ -43,3 +67,7 @@ class CentrifugalPump(HydraulicBlock):
 
     def qp_balance_aux(self, q, p_in, p_out):
         return p_out - p_in - self.qp_lut(q)
+
+    def qp_jacobian(self):
+        q = self.states[0].value
+        return [-self.qp_lut_slope(q), -1., 1.]
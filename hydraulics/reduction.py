@@ -0,0 +1,308 @@
+from .compiled import PipeGroup, ResistanceGroup, JointGroup
+from .decomposition import split_labels
+from .solvers import newton_solve
+from scipy import sparse
+import numpy as np
+
+passiveGroups = (PipeGroup, ResistanceGroup)
+
+def passive_table(compiled):
+    rows = [group.rows for group in compiled.groups if isinstance(group, passiveGroups)]
+    index = [group.index for group in compiled.groups if isinstance(group, passiveGroups)]
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 3), dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(index)
+
+def joint_table(compiled, n_in, n_out):
+    rows = []
+    index = []
+    for group in compiled.groups:
+        if isinstance(group, JointGroup) and (group.blocks[0].n_in, group.blocks[0].n_out) == (n_in, n_out):
+            rows.append(group.rows)
+            index.append(group.index)
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, n_in + n_out + 1), dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(index)
+
+def find_series(index, counts, nStates):
+    q, p_in, p_out = index.T
+    n = len(q)
+    interior = counts == 2
+    interior[nStates:] = False
+    inPos = np.full(len(counts), -1, dtype=np.int64)
+    inPos[p_in] = np.arange(n)
+    nxt = np.full(n, -1, dtype=np.int64)
+    cand = np.flatnonzero(interior[p_out] & (inPos[p_out] >= 0))
+    succ = inPos[p_out[cand]]
+    valid = (q[succ] == q[cand]) & (succ != cand)
+    nxt[cand[valid]] = succ[valid]
+    hasPrev = np.zeros(n, dtype=bool)
+    hasPrev[nxt[nxt >= 0]] = True
+    chains = []
+    nxtList = nxt.tolist()
+    for i in np.flatnonzero((nxt >= 0) & ~hasPrev).tolist():
+        chain = [i]
+        while nxtList[chain[-1]] >= 0:
+            chain.append(nxtList[chain[-1]])
+        chains.append(chain)
+    return chains
+
+def unique_map(keys):
+    mapping = dict()
+    for i, key in enumerate(keys):
+        mapping[key] = -1 if key in mapping else i
+    return mapping
+
+def find_parallel(units, index, splitters, mixers, counts, nStates):
+    q = [index[unit[0], 0] for unit in units]
+    p_in = [index[unit[0], 1] for unit in units]
+    p_out = [index[unit[-1], 2] for unit in units]
+    unitByQ = unique_map(q)
+    mixerByP = unique_map(mixers[:, 3].tolist())
+    used = set()
+    parallels = []
+    for s, (q_in, q_out1, q_out2, p) in enumerate(splitters.tolist()):
+        u1 = unitByQ.get(q_out1, -1)
+        u2 = unitByQ.get(q_out2, -1)
+        if u1 < 0 or u2 < 0 or u1 == u2 or u1 in used or u2 in used:
+            continue
+        if p_in[u1] != p or p_in[u2] != p or p_out[u1] != p_out[u2] or p_out[u1] == p:
+            continue
+        m = mixerByP.get(p_out[u1], -1)
+        if m < 0 or sorted(mixers[m, :2].tolist()) != sorted([q[u1], q[u2]]):
+            continue
+        if any(q[u] >= nStates or counts[q[u]] != len(units[u]) + 2 for u in (u1, u2)):
+            continue
+        used.update((u1, u2))
+        parallels.append((s, m, u1, u2))
+    return parallels
+
+
+class ChainSet:
+    def __init__(self, compiled, rows, index, chains):
+        plan = compiled.plan
+        self.nChains = len(chains)
+        lengths = np.array([len(chain) for chain in chains], dtype=np.int64)
+        elements = np.array([i for chain in chains for i in chain], dtype=np.int64)
+        self.owner = np.repeat(np.arange(self.nChains), lengths)
+        self.starts = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+        self.notLast = np.ones(len(elements), dtype=bool)
+        self.notLast[self.starts + lengths - 1] = False
+        self.rows = rows[elements]
+        self.interiorCols = index[elements, 2][self.notLast]
+        self.parts = []
+        groupIdx = plan.rowGroup[self.rows]
+        for members in split_labels(groupIdx):
+            group = compiled.groups[groupIdx[members[0]]]
+            slots = plan.rowSlot[self.rows[members]]
+            sub = type(group)([group.blocks[i] for i in slots.tolist()], members, np.zeros((len(members), 3)))
+            self.parts.append((sub, members))
+
+    def element_drops(self, q):
+        qe = q[self.owner]
+        dp = np.empty(len(qe))
+        slope = np.empty(len(qe))
+        for sub, members in self.parts:
+            dp[members], slope[members] = sub.qp_drop(qe[members])
+        return dp, slope
+
+    def drops(self, q):
+        dp, slope = self.element_drops(q)
+        return np.bincount(self.owner, dp, self.nChains), np.bincount(self.owner, slope, self.nChains)
+
+    def flows(self, dp, q0, maxIter=200):
+        sign = np.where(dp < 0, -1., 1.)
+        target = np.abs(dp)
+        tol = 1e-12 * np.maximum(target, 1.)
+        q = np.abs(q0)
+        lo = np.zeros_like(q)
+        hi = np.full_like(q, np.inf)
+        for it in range(maxIter):
+            d, slope = self.drops(q)
+            r = d - target
+            done = np.abs(r) <= tol
+            if np.all(done):
+                break
+            lo = np.where(r < 0, q, lo)
+            hi = np.where(r > 0, q, hi)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                qNew = q - r / slope
+            bad = ~((qNew > lo) & (qNew < hi))
+            qNew = np.where(bad, np.where(np.isfinite(hi), 0.5 * (lo + hi), 2. * q + 1.), qNew)
+            q = np.where(done, q, qNew)
+        d, slope = self.drops(q)
+        return sign * q, np.maximum(slope, 1e-12)
+
+    def interior_pressures(self, q, p_in):
+        dp, slope = self.element_drops(q)
+        total = np.cumsum(dp)
+        before = (total - dp)[self.starts]
+        return (p_in[self.owner] - (total - before[self.owner]))[self.notLast]
+
+
+class ReducedSystem:
+    def __init__(self, compiled, keptRows, keptCols, series, branches, parallelCols):
+        self.compiled = compiled
+        self.keptCols = keptCols
+        self.nKept = len(keptCols)
+        self.constVal = compiled.constVal
+        self.sub = compiled.subsystem(keptRows, keptCols)
+        self.sub.constVal = compiled.constVal[self.sub.extCols - compiled.nStates]
+        self.nSub = len(keptRows)
+        localOf = np.full(compiled.nStates, -1, dtype=np.int64)
+        localOf[keptCols] = np.arange(self.nKept)
+        local = lambda cols: np.where(cols < compiled.nStates, localOf[np.minimum(cols, compiled.nStates - 1)],
+                                      self.nKept + cols - compiled.nStates)
+        self.series, seriesCols = series
+        self.seriesCols = local(seriesCols)
+        self.branches, branchQ = branches
+        self.branchQ = branchQ
+        self.parallelCols = local(parallelCols)
+        self.branchFlows = np.zeros(len(branchQ))
+        self._lastDp = None
+
+    def expand_values(self, xr):
+        return np.concatenate((np.asarray(xr, dtype=float)[:self.nKept], self.constVal))
+
+    def branch_flows(self, w):
+        q_in, q_out, p_split, p_mix = w[self.parallelCols].T
+        dp = np.repeat(p_split - p_mix, 2)
+        if self._lastDp is None or not np.array_equal(dp, self._lastDp):
+            self.branchFlows, self._slopes = self.branches.flows(dp, self.branchFlows)
+            self._lastDp = dp
+        return self.branchFlows, self._slopes
+
+    def qp_balance(self, xr):
+        w = self.expand_values(xr)
+        y = [self.sub.qp_balance(xr)]
+        if self.series is not None:
+            q, p_in, p_out = w[self.seriesCols].T
+            dp, slope = self.series.drops(q)
+            y.append(p_in - p_out - dp)
+        if self.branches is not None:
+            flows, slopes = self.branch_flows(w)
+            total = flows[0::2] + flows[1::2]
+            q_in, q_out, p_split, p_mix = w[self.parallelCols].T
+            y.append(q_in - total)
+            y.append(total - q_out)
+        return np.concatenate(y)
+
+    def qp_jacobian(self, xr):
+        w = self.expand_values(xr)
+        rows = []
+        cols = []
+        data = []
+        row = self.nSub
+        if self.series is not None:
+            q, p_in, p_out = w[self.seriesCols].T
+            dp, slope = self.series.drops(q)
+            n = len(q)
+            rows.append(np.repeat(np.arange(row, row + n), 3))
+            cols.append(self.seriesCols.ravel())
+            data.append(np.column_stack((-slope, np.ones(n), -np.ones(n))).ravel())
+            row += n
+        if self.branches is not None:
+            flows, slopes = self.branch_flows(w)
+            g = 1. / slopes[0::2] + 1. / slopes[1::2]
+            n = len(g)
+            ones = np.ones(n)
+            q_in, q_out, p_split, p_mix = self.parallelCols.T
+            rows.append(np.repeat(np.arange(row, row + n), 3))
+            cols.append(np.column_stack((q_in, p_split, p_mix)).ravel())
+            data.append(np.column_stack((ones, -g, g)).ravel())
+            rows.append(np.repeat(np.arange(row + n, row + 2 * n), 3))
+            cols.append(np.column_stack((q_out, p_split, p_mix)).ravel())
+            data.append(np.column_stack((-ones, g, -g)).ravel())
+            row += 2 * n
+        width = max(len(xr), self.nKept)
+        rows = np.concatenate(rows) - self.nSub
+        cols = np.concatenate(cols)
+        data = np.concatenate(data)
+        mask = cols < self.nKept
+        composite = sparse.csr_matrix((data[mask], (rows[mask], cols[mask])), shape=(row - self.nSub, width))
+        return sparse.vstack((self.sub.qp_jacobian(xr), composite), format='csr')
+
+    def expand(self, xr, x0):
+        x = np.array(x0, dtype=float)
+        x[self.keptCols] = xr
+        w = self.expand_values(xr)
+        if self.series is not None:
+            q, p_in, p_out = w[self.seriesCols].T
+            x[self.series.interiorCols] = self.series.interior_pressures(q, p_in)
+        if self.branches is not None:
+            flows, slopes = self.branch_flows(w)
+            q_in, q_out, p_split, p_mix = w[self.parallelCols].T
+            x[self.branchQ] = flows
+            x[self.branches.interiorCols] = self.branches.interior_pressures(flows, np.repeat(p_split, 2))
+        return x
+
+
+def const_columns(nStates, constSource):
+    columns = np.arange(nStates + len(constSource))
+    if len(constSource):
+        sources, first, inverse = np.unique(constSource, return_index=True, return_inverse=True)
+        columns[nStates:] = nStates + first[inverse.ravel()]
+    return columns
+
+def reduce_network(compiled, constSource=None):
+    nStates = compiled.nStates
+    if constSource is None:
+        constSource = np.arange(len(compiled.constVal))
+    columns = const_columns(nStates, constSource)
+    rows, index = passive_table(compiled)
+    splitRows, splitters = joint_table(compiled, 1, 2)
+    mixRows, mixers = joint_table(compiled, 2, 1)
+    index, splitters, mixers = columns[index], columns[splitters], columns[mixers]
+    allIndex = [group.index.ravel() for group in compiled.groups] + [np.zeros(0, dtype=np.int64)]
+    counts = np.bincount(columns[np.concatenate(allIndex)], minlength=len(columns))
+
+    chains = find_series(index, counts, nStates)
+    inChain = np.zeros(len(rows), dtype=bool)
+    for chain in chains:
+        inChain[chain] = True
+    units = chains + [[i] for i in np.flatnonzero(~inChain).tolist()]
+    parallels = find_parallel(units, index, splitters, mixers, counts, nStates)
+    branchUnits = set(u for s, m, u1, u2 in parallels for u in (u1, u2))
+    seriesChains = [chain for u, chain in enumerate(chains) if u not in branchUnits]
+    branchChains = [units[u] for s, m, u1, u2 in parallels for u in (u1, u2)]
+    if not seriesChains and not branchChains:
+        return None
+
+    series = (None, np.zeros((0, 3), dtype=np.int64))
+    if seriesChains:
+        chainSet = ChainSet(compiled, rows, index, seriesChains)
+        series = (chainSet, np.array([[index[c[0], 0], index[c[0], 1], index[c[-1], 2]] for c in seriesChains]))
+    branches = (None, np.zeros(0, dtype=np.int64))
+    parallelCols = np.zeros((0, 4), dtype=np.int64)
+    if branchChains:
+        chainSet = ChainSet(compiled, rows, index, branchChains)
+        branches = (chainSet, np.array([index[c[0], 0] for c in branchChains], dtype=np.int64))
+        parallelCols = np.array([[splitters[s, 0], mixers[m, 2], splitters[s, 3], mixers[m, 3]]
+                                 for s, m, u1, u2 in parallels], dtype=np.int64)
+
+    removedRows = [chainSet.rows for chainSet in (series[0], branches[0]) if chainSet is not None]
+    removedRows += [splitRows[[s for s, m, u1, u2 in parallels]], mixRows[[m for s, m, u1, u2 in parallels]]]
+    removedCols = [chainSet.interiorCols for chainSet in (series[0], branches[0]) if chainSet is not None]
+    removedCols += [branches[1]]
+    keptRows = np.setdiff1d(np.arange(compiled.nEquations), np.concatenate(removedRows))
+    keptCols = np.setdiff1d(np.arange(nStates), np.concatenate(removedCols))
+    reduced = ReducedSystem(compiled, keptRows, keptCols, series, branches, parallelCols)
+    if np.any(reduced.sub.extCols < nStates):
+        return None
+    return reduced
+
+def solve_reduced(assy, x0, xtol=1e-6):
+    stats = {'nfev': 0, 'njev': 0, 'nit': 0}
+    reduced = reduce_network(assy.compiled, assy.get_constSources()) if assy.compiled is not None else None
+    if reduced is None:
+        return None, stats
+    x0 = np.asarray(x0, dtype=float)
+    if reduced.branches is not None:
+        reduced.branchFlows = x0[reduced.branchQ]
+    stats['reducedStates'] = reduced.nKept
+    xr, info, ok = newton_solve(reduced.qp_balance, reduced.qp_jacobian, x0[reduced.keptCols], xtol=xtol)
+    for key in ('nfev', 'njev', 'nit'):
+        stats[key] += info[key]
+    if ok:
+        assy.set_states_val(reduced.expand(xr, x0))
+    return ok, stats
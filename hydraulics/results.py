@@ -0,0 +1,77 @@
+import numpy as np
+
+units = {'Q': 'lpm', 'P': 'kPa'}
+
+def numeric_result(assy):
+    value = assy.store.value
+    portIds, qNodes, pNodes = assy.get_portNodes()
+    stateIds, stateNodes = assy.get_stateNodes(merged=True)
+    return {'format': 'numeric',
+            'units': units,
+            'ports': {'ids': portIds, 'Q': value[qNodes].tolist(), 'P': value[pNodes].tolist()},
+            'states': {'ids': stateIds, 'values': value[stateNodes].tolist()}}
+
+def port_outputs(assy, outputs=None):
+    ids, qNodes, pNodes = assy.get_portNodes()
+    nodes = dict()
+    for portId, q, p in zip(ids, qNodes.tolist(), pNodes.tolist()):
+        nodes[portId + '.Q'] = q
+        nodes[portId + '.P'] = p
+    if outputs is None:
+        outputs = list(nodes)
+    for key in outputs:
+        if key not in nodes:
+            raise Exception(f"Unknown output {key}. Use <block>.<port>.Q or <block>.<port>.P.")
+    return list(outputs), np.array([nodes[key] for key in outputs], dtype=np.int64)
+
+def diff_section(base, section, fields, tol):
+    ids = section['ids']
+    new = {f: np.asarray(section[f], dtype=float) for f in fields}
+    if base is not None and (base['ids'] is ids or base['ids'] == ids):
+        changed = np.zeros(len(ids), dtype=bool)
+        for f in fields:
+            changed |= ~(np.abs(new[f] - base[f]) <= tol)
+        removed = []
+    else:
+        basePos = {} if base is None else {k: i for i, k in enumerate(base['ids'])}
+        pos = np.array([basePos.get(k, -1) for k in ids], dtype=np.int64)
+        changed = pos < 0
+        for f in fields:
+            old = base[f][pos] if base is not None else new[f]
+            changed |= ~(np.abs(new[f] - old) <= tol)
+        removed = [] if base is None else sorted(set(base['ids']) - set(ids))
+        if base is not None:
+            base = {f: np.where(pos < 0, new[f], base[f][pos]) for f in fields}
+    keep = {'ids': ids}
+    for f in fields:
+        keep[f] = new[f] if base is None else np.where(changed, new[f], base[f])
+    index = np.flatnonzero(changed)
+    delta = {'ids': [ids[i] for i in index]}
+    for f in fields:
+        delta[f] = new[f][index].tolist()
+    return delta, removed, keep
+
+
+class DeltaEncoder:
+    def __init__(self):
+        self.base = None
+        self.resultId = 0
+
+    def reset(self):
+        self.base = None
+
+    def encode(self, result, tol=1e-4, baseId=None):
+        if not isinstance(result, dict) or result.get('format') != 'numeric':
+            return result
+        sections = {'ports': ('Q', 'P'), 'states': ('values',)}
+        self.resultId += 1
+        if self.base is None or (baseId is not None and baseId != self.resultId - 1):
+            self.base = {name: diff_section(None, result[name], fields, tol)[2] for name, fields in sections.items()}
+            return dict(result, delta=False, resultId=self.resultId)
+        encoded = {'format': 'numeric', 'units': result['units'], 'delta': True, 'resultId': self.resultId,
+                   'removed': {}}
+        for name, fields in sections.items():
+            delta, removed, self.base[name] = diff_section(self.base[name], result[name], fields, tol)
+            encoded[name] = delta
+            encoded['removed'][name] = removed
+        return encoded
@@ -0,0 +1,106 @@
+from .diagram_handler import build_assembly, solve_assembly
+from .sweep import find_setter
+from .results import port_outputs, units
+from .solvers import chord_solve
+from .metrics import record_solve
+import numpy as np
+import time
+import sys
+
+def read_series(assy, series, times=None, dt=None):
+    if not isinstance(series, dict) or not series:
+        raise Exception("Scenario series shall map <block>.<parameter> keys to lists of values.")
+    columns = []
+    for key, values in series.items():
+        block, setter = find_setter(assy, key, 'schedule')
+        columns.append((block, getattr(block, setter), np.asarray(values, dtype=float)))
+    nSteps = len(columns[0][2])
+    if any(values.ndim != 1 or len(values) != nSteps for block, setter, values in columns):
+        raise Exception("All scenario series shall be flat lists of the same length.")
+    if times is None:
+        times = np.arange(nSteps) * (1. if dt is None else float(dt))
+    else:
+        times = np.asarray(times, dtype=float)
+        if times.shape != (nSteps,):
+            raise Exception("Scenario times shall have one value per series step.")
+    return columns, times
+
+
+class ScenarioRunner:
+    def __init__(self, diagramData, series, times=None, dt=None, outputs=None, reduce=False):
+        start = time.perf_counter()
+        self.assy = build_assembly(diagramData)
+        self.params = list(series)
+        self.columns, self.times = read_series(self.assy, series, times, dt)
+        self.outputs, self.outNodes = port_outputs(self.assy, outputs)
+        self.buildTime = time.perf_counter() - start
+        self.reduce = reduce
+        self.factor = None
+        self.seed = None
+        self.metrics = {'nBlocks': len(self.assy.blocks), 'nStates': self.assy.nStates,
+                        'nSteps': len(self.times), 'nfev': 0, 'njev': 0, 'nit': 0, 'factorizations': 0,
+                        'fullSolves': 0, 'failedSteps': 0}
+
+    def header(self):
+        return {'format': 'columnar', 'units': units, 'outputs': self.outputs,
+                'params': self.params, 'nSteps': len(self.times)}
+
+    def apply_step(self, k):
+        for block, setter, values in self.columns:
+            setter(float(values[k]))
+        self.assy.refresh_params([block for block, setter, values in self.columns])
+
+    def solve_step(self):
+        assy = self.assy
+        x, info, ok, self.factor = chord_solve(assy.qp_balance, assy.qp_jacobian, self.seed, self.factor)
+        for key in ('nfev', 'njev', 'nit', 'factorizations'):
+            self.metrics[key] += info[key]
+        if not ok:
+            self.factor = None
+            self.metrics['fullSolves'] += 1
+            assy.set_states_val(self.seed)
+            x, ok = assy.solve(method='decomposed', reduce=self.reduce)
+            for key in ('nfev', 'njev', 'nit'):
+                self.metrics[key] += assy.solveInfo[key]
+        assy.set_states_val(x)
+        if ok:
+            self.seed = np.asarray(x, dtype=float)[:assy.nStates]
+        else:
+            self.metrics['failedSteps'] += 1
+        return ok
+
+    def run(self, chunkSize=256):
+        assy = self.assy
+        start = time.perf_counter()
+        solve_assembly(assy, reduce=self.reduce)
+        self.seed = np.asarray(assy.get_init_values(), dtype=float)
+        nSteps = len(self.times)
+        for first in range(0, nSteps, chunkSize):
+            steps = range(first, min(first + chunkSize, nSteps))
+            values = np.empty((len(self.outNodes), len(steps)))
+            converged = []
+            for i, k in enumerate(steps):
+                self.apply_step(k)
+                converged.append(bool(self.solve_step()))
+                values[:, i] = assy.store.value[self.outNodes]
+            yield {'index': list(steps),
+                   'time': self.times[first:first + len(steps)].tolist(),
+                   'converged': converged,
+                   'columns': dict(zip(self.outputs, values.tolist()))}
+        self.metrics['solveTime'] = time.perf_counter() - start
+        self.metrics['buildTime'] = self.buildTime
+
+
+def run_scenario(diagramData, series, times=None, dt=None, outputs=None, chunkSize=256, reduce=False):
+    runner = ScenarioRunner(diagramData, series, times, dt, outputs, reduce)
+    yield runner.header()
+    status = 'fail'
+    message = ''
+    try:
+        yield from runner.run(chunkSize)
+        status = 'success' if runner.metrics['failedSteps'] == 0 else 'marginal'
+    except Exception as e:
+        message = str(e)
+        print('Error in hydraulics model or solver: ' + message, file=sys.stderr)
+    record_solve(status, runner.metrics, diagramData)
+    yield {'status': status, 'message': message, 'metrics': runner.metrics}
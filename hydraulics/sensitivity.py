@@ -0,0 +1,125 @@
+from collections import defaultdict
+from .sweep import find_setter
+from .results import port_outputs
+from .diagram_handler import build_assembly, solve_assembly, DiagramError
+from .metrics import record_solve
+from scipy.sparse.linalg import splu
+from scipy import sparse
+import numpy as np
+import time
+import sys
+
+def read_param(assy, key):
+    block, setter = find_setter(assy, key, 'differentiate')
+    return getattr(block, 'get_' + setter[4:]), getattr(block, setter)
+
+def dependent_rows(assy):
+    rowOf = {uid: i for i, uid in enumerate(assy.get_eqBlockIds())}
+    store = assy.store
+    users = defaultdict(set)
+    for node, src in zip(assy.get_constNodes().tolist(), assy.get_constSources().tolist()):
+        uid = store.blockIds[store.blockIdx[node]]
+        if uid in rowOf:
+            users[src].add(uid)
+    return rowOf, users
+
+def param_derivatives(assy, params, outNodes, step=1e-6):
+    rowOf, users = dependent_rows(assy)
+    value = assy.store.value
+    rows = []
+    cols = []
+    data = []
+    direct = np.zeros((len(outNodes), len(params)))
+    for k, key in enumerate(params):
+        uid = key.rpartition('.')[0]
+        getter, setter = read_param(assy, key)
+        affected = {uid} if uid in rowOf else set()
+        for node in assy.get_blockNodes(uid):
+            affected |= users.get(node, set())
+        affected = sorted(affected, key=rowOf.get)
+        theta = getter()
+        h = step * max(abs(theta), 1.)
+        evals = []
+        try:
+            for t in (theta + h, theta - h):
+                setter(t)
+                assy.update_constStVal()
+                evals.append((np.array([assy.blocks[a].qp_balance() for a in affected], dtype=float),
+                              value[outNodes].copy()))
+        finally:
+            setter(theta)
+            assy.update_constStVal()
+        rows.extend(rowOf[a] for a in affected)
+        cols.extend([k] * len(affected))
+        data.extend(((evals[0][0] - evals[1][0]) / (2 * h)).tolist())
+        direct[:, k] = (evals[0][1] - evals[1][1]) / (2 * h)
+    return sparse.csc_matrix((data, (rows, cols)), shape=(len(rowOf), len(params))), direct
+
+def solve_columns(lu, rhs, trans='N', chunk=256):
+    out = np.empty(rhs.shape)
+    for start in range(0, rhs.shape[1], chunk):
+        out[:, start:start + chunk] = lu.solve(rhs[:, start:start + chunk].toarray(), trans)
+    return out
+
+def compute_sensitivities(assy, params, outputs=None):
+    if assy.solveInfo is None:
+        raise Exception("Solve the assembly before computing sensitivities.")
+    params = list(params)
+    outputs, outNodes = port_outputs(assy, outputs)
+    x = np.asarray(assy.get_init_values(), dtype=float)
+    jac = assy.qp_jacobian(x)
+    if jac.shape[0] < assy.nStates:
+        raise Exception("Not enough balance equations to solve for all unknown Q and P.")
+    B, direct = param_derivatives(assy, params, outNodes)
+    if jac.shape[0] != jac.shape[1]:
+        B = sparse.csc_matrix(jac.T @ B)
+        jac = jac.T @ jac
+
+    cols = assy.store.assyIdx[outNodes]
+    isState = cols >= 0
+    S = sparse.csr_matrix((np.ones(int(isState.sum())), (np.flatnonzero(isState), cols[isState])),
+                          shape=(len(outputs), assy.nStates))
+    lu = splu(sparse.csc_matrix(jac))
+    if len(outputs) <= len(params):
+        mode = 'adjoint'
+        adjoint = solve_columns(lu, S.T.tocsc(), 'T')
+        dydp = -np.asarray((B.T @ adjoint).T)
+    else:
+        mode = 'forward'
+        dxdp = solve_columns(lu, B, 'N')
+        dydp = -np.asarray(S @ dxdp)
+    dydp += direct
+
+    return {'outputs': outputs,
+            'params': params,
+            'values': assy.store.value[outNodes].tolist(),
+            'paramValues': [read_param(assy, key)[0]() for key in params],
+            'derivatives': dydp.tolist(),
+            'mode': mode,
+            'converged': bool(assy.solveInfo.get('converged'))}
+
+def run_sensitivity(diagramData, params, outputs=None, reduce=False):
+    status = 'fail'
+    message = ''
+    result = {}
+    metrics = {}
+    try:
+        start = time.perf_counter()
+        assy = build_assembly(diagramData)
+        metrics['buildTime'] = time.perf_counter() - start
+        metrics['nBlocks'] = len(assy.blocks)
+        metrics['nStates'] = assy.nStates
+        ok = solve_assembly(assy, reduce=reduce)
+        metrics.update(assy.solveInfo)
+        start = time.perf_counter()
+        result = compute_sensitivities(assy, params, outputs)
+        metrics['sensitivityTime'] = time.perf_counter() - start
+        status = 'success' if ok else 'marginal'
+    except DiagramError as e:
+        status, message, result = 'invalid', str(e), {'errors': e.errors}
+    except Exception as e:
+        message = str(e)
+        print('Error in hydraulics model or solver: ' + message, file=sys.stderr)
+
+    record_solve(status, metrics, diagramData)
+    return status, message, result, metrics
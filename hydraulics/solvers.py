@@ -0,0 +1,95 @@
+from scipy.sparse.linalg import splu
+import numpy as np
+import warnings
+
+def newton_solve(fun, jac, x0, xtol=1e-6, ftol=1e-9, maxIter=100):
+    x = np.array(x0, dtype=float)
+    f = np.asarray(fun(x), dtype=float)
+    info = {'nfev': 1, 'njev': 0, 'nit': 0}
+    ok = False
+    for it in range(maxIter):
+        info['nit'] = it + 1
+        J = jac(x)
+        info['njev'] += 1
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                if J.shape[0] == J.shape[1]:
+                    dx = -splu(J.tocsc()).solve(f)
+                else:
+                    dx = -splu((J.T @ J).tocsc()).solve(J.T @ f)
+        except (RuntimeError, Warning):
+            break
+        if not np.all(np.isfinite(dx)):
+            break
+
+        fNorm = np.dot(f, f)
+        step = 1.
+        while True:
+            xNew = x + step * dx
+            fNew = np.asarray(fun(xNew), dtype=float)
+            info['nfev'] += 1
+            if np.dot(fNew, fNew) < fNorm or step < 1e-4:
+                break
+            step *= 0.5
+        x, f = xNew, fNew
+
+        converged = step == 1. and np.linalg.norm(dx) <= xtol * (np.linalg.norm(x) + xtol)
+        if converged or np.max(np.abs(f)) <= ftol:
+            ok = True
+            break
+    info['fvec'] = f
+    return x, info, ok
+
+
+class JacobianFactor:
+    def __init__(self, J):
+        self.J = J
+        self.square = J.shape[0] == J.shape[1]
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            self.lu = splu(J.tocsc() if self.square else (J.T @ J).tocsc())
+
+    def solve(self, f):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            return self.lu.solve(f if self.square else self.J.T @ f)
+
+def chord_solve(fun, jac, x0, factor=None, xtol=1e-6, ftol=1e-9, maxIter=20, rate=0.5):
+    x = np.array(x0, dtype=float)
+    f = np.asarray(fun(x), dtype=float)
+    info = {'nfev': 1, 'njev': 0, 'nit': 0, 'factorizations': 0}
+    fresh = False
+    ok = False
+    for it in range(maxIter):
+        if np.max(np.abs(f), initial=0.) <= ftol:
+            ok = True
+            break
+        info['nit'] = it + 1
+        try:
+            if factor is None:
+                factor = JacobianFactor(jac(x))
+                info['njev'] += 1
+                info['factorizations'] += 1
+                fresh = True
+            dx = -factor.solve(f)
+        except (RuntimeError, Warning):
+            factor = None
+            break
+        xNew = x + dx
+        fNew = np.asarray(fun(xNew), dtype=float)
+        info['nfev'] += 1
+        if not np.all(np.isfinite(fNew)) or np.linalg.norm(fNew) > rate * np.linalg.norm(f):
+            if fresh and np.all(np.isfinite(fNew)) and np.dot(fNew, fNew) < np.dot(f, f):
+                x, f = xNew, fNew
+            elif fresh:
+                break
+            factor = None
+            continue
+        x, f = xNew, fNew
+        fresh = False
+        if np.max(np.abs(dx)) <= xtol * (np.max(np.abs(x)) + xtol):
+            ok = True
+            break
+    info['fvec'] = f
+    return x, info, ok, factor
@@ -0,0 +1,138 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .diagram_handler import build_assembly, solve_assembly, get_port_states
+from .curves import curveRegistry
+from .jobs import worker_context
+import itertools
+import tempfile
+import os
+
+paramSetters = {
+    'PumpSpeedPct':     'set_speedPct',
+    'ValveOpeningPct':  'set_openPct',
+    'PressureConst':    'set_pConst',
+    'InnerDiameter':    'set_diameter',
+    'PipeLength':       'set_length'
+}
+
+def grid_points(grid):
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+def find_setter(assy, key, action='sweep'):
+    uid, _, name = key.rpartition('.')
+    if uid not in assy.blocks:
+        raise Exception(f"Cannot {action} {key}. Block {uid} is not in the diagram.")
+    block = assy.blocks[uid]
+    if name not in paramSetters or not hasattr(block, paramSetters[name]):
+        raise Exception(f"Cannot {action} {key}. Parameter {name} is not supported for this block.")
+    return block, paramSetters[name]
+
+def check_params(assy, params):
+    for key in params:
+        find_setter(assy, key)
+
+def sweep_tables(assy, points):
+    blocks = assy.blocks.values()
+    tables = [b.curve for b in blocks if hasattr(b, 'curve')] + [b.lut for b in blocks if hasattr(b, 'lut')]
+    for index, params in points:
+        for key, value in params.items():
+            block, setter = find_setter(assy, key)
+            if setter == 'set_speedPct':
+                try:
+                    block.set_speedPct(float(value))
+                except (TypeError, ValueError):
+                    continue
+                tables.append(block.lut)
+    return tables
+
+def base_params(assy, keys):
+    base = {}
+    for key in keys:
+        block, setter = find_setter(assy, key)
+        base[key] = getattr(block, 'get_' + setter[4:])()
+    return base
+
+def apply_params(assy, params):
+    for key, value in params.items():
+        uid, _, name = key.rpartition('.')
+        getattr(assy.blocks[uid], paramSetters[name])(float(value))
+    assy.refresh_params()
+
+
+class SweepWorker:
+    def __init__(self, diagramData, keys=(), assy=None):
+        self.assy = build_assembly(diagramData) if assy is None else assy
+        self.base = base_params(self.assy, keys)
+        solve_assembly(self.assy)
+        self.seed = self.assy.states_to_dict(merged=True)
+
+    def solve_chunk(self, chunk):
+        results = []
+        self.assy.set_init_values(self.seed)
+        for index, params in chunk:
+            status = 'fail'
+            message = ''
+            result = {}
+            try:
+                apply_params(self.assy, {**self.base, **params})
+                x, ok = self.assy.solve()
+                result = get_port_states(self.assy)
+                status = 'success' if ok else 'marginal'
+            except Exception as e:
+                message = str(e)
+            if status != 'success':
+                self.assy.set_init_values(self.seed)
+            results.append({'index': index, 'params': params, 'status': status,
+                            'message': message, 'result': result})
+        return results
+
+_worker = None
+
+def _init_worker(diagramData, keys, curvePath=None):
+    global _worker
+    if curvePath is not None:
+        curveRegistry.attach(curvePath)
+    _worker = SweepWorker(diagramData, keys)
+
+def _solve_chunk(chunk):
+    return _worker.solve_chunk(chunk)
+
+def run_sweep(diagramData, grid=None, points=None, workers=None, chunkSize=None):
+    if points is None:
+        points = grid_points(grid or {})
+    points = list(enumerate(points))
+    if not points:
+        return
+    assy = build_assembly(diagramData)
+    keys = list({k: None for _, p in points for k in p})
+    check_params(assy, keys)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(points)))
+    if chunkSize is None:
+        chunkSize = max(1, min(64, len(points) // (4 * workers)))
+    chunks = [points[i:i + chunkSize] for i in range(0, len(points), chunkSize)]
+
+    if workers == 1:
+        worker = SweepWorker(diagramData, keys, assy)
+        for chunk in chunks:
+            yield from worker.solve_chunk(chunk)
+        return
+
+    fd, curvePath = tempfile.mkstemp(prefix='hydrui-curves-', suffix='.npy')
+    os.close(fd)
+    try:
+        curveRegistry.export(curvePath, sweep_tables(assy, points))
+        del assy
+        with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context(), initializer=_init_worker,
+                                 initargs=(diagramData, keys, curvePath)) as pool:
+            futures = [pool.submit(_solve_chunk, chunk) for chunk in chunks]
+            try:
+                for future in as_completed(futures):
+                    yield from future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+    finally:
+        os.remove(curvePath)
@@ -0,0 +1,239 @@
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from collections import OrderedDict
+import threading
+import abc
+import hashlib
+import secrets
+import sqlite3
+import json
+import time
+import zlib
+
+def encode_value(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+def blob_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class SessionStore(abc.ABC):
+    def __init__(self, ttl=86400., inlineLimit=256):
+        self.ttl = ttl
+        self.inlineLimit = inlineLimit
+
+    def pack(self, data):
+        record = {}
+        blobs = {}
+        for key, value in data.items():
+            text = encode_value(value)
+            if len(text) < self.inlineLimit:
+                record[key] = value
+            else:
+                h = blob_hash(text)
+                blobs[h] = text
+                record[key] = {'$blob': h}
+        return record, blobs
+
+    def unpack(self, record):
+        data = {}
+        for key, value in record.items():
+            if isinstance(value, dict) and set(value) == {'$blob'}:
+                text = self.get_blob(value['$blob'])
+                if text is None:
+                    continue
+                value = json.loads(text)
+            data[key] = value
+        return data
+
+    @abc.abstractmethod
+    def load(self, sid):
+        pass
+
+    @abc.abstractmethod
+    def save(self, sid, data):
+        pass
+
+    @abc.abstractmethod
+    def delete(self, sid):
+        pass
+
+    @abc.abstractmethod
+    def get_blob(self, h):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, maxSessions=10000, ttl=86400., inlineLimit=256):
+        super().__init__(ttl, inlineLimit)
+        self.maxSessions = maxSessions
+        self._sessions = OrderedDict()
+        self._blobs = dict()
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._drop(sid)
+                return None
+            self._sessions[sid] = (time.time() + self.ttl,) + entry[1:]
+            self._sessions.move_to_end(sid)
+            record = entry[1]
+        return self.unpack(record)
+
+    def save(self, sid, data):
+        record, blobs = self.pack(data)
+        with self._lock:
+            for h, text in blobs.items():
+                if h in self._blobs:
+                    self._blobs[h][1] += 1
+                else:
+                    self._blobs[h] = [zlib.compress(text.encode()), 1]
+            if sid in self._sessions:
+                self._drop(sid)
+            self._sessions[sid] = (time.time() + self.ttl, record, list(blobs))
+            self._purge()
+
+    def delete(self, sid):
+        with self._lock:
+            if sid in self._sessions:
+                self._drop(sid)
+
+    def get_blob(self, h):
+        with self._lock:
+            entry = self._blobs.get(h)
+        return zlib.decompress(entry[0]).decode() if entry is not None else None
+
+    def stats(self):
+        with self._lock:
+            return {'sessions': len(self._sessions),
+                    'blobs': len(self._blobs),
+                    'blobBytes': sum(len(b[0]) for b in self._blobs.values())}
+
+    def _drop(self, sid):
+        expires, record, refs = self._sessions.pop(sid)
+        for h in refs:
+            self._blobs[h][1] -= 1
+            if self._blobs[h][1] <= 0:
+                del self._blobs[h]
+
+    def _purge(self):
+        now = time.time()
+        while self._sessions:
+            sid, entry = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.maxSessions and entry[0] >= now:
+                break
+            self._drop(sid)
+
+
+class SqliteSessionStore(SessionStore):
+    def __init__(self, path, ttl=86400., inlineLimit=256, purgeEvery=100):
+        super().__init__(ttl, inlineLimit)
+        self.purgeEvery = purgeEvery
+        self._nSaves = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS sessions '
+                             '(sid TEXT PRIMARY KEY, record TEXT, expires REAL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, data BLOB)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS session_blobs (sid TEXT, hash TEXT)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS session_blobs_sid ON session_blobs (sid)')
+
+    def load(self, sid):
+        with self._lock:
+            row = self._db.execute('SELECT record, expires FROM sessions WHERE sid = ?', (sid,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                with self._db:
+                    self._delete(sid)
+                return None
+            with self._db:
+                self._db.execute('UPDATE sessions SET expires = ? WHERE sid = ?', (time.time() + self.ttl, sid))
+        return self.unpack(json.loads(row[0]))
+
+    def save(self, sid, data):
+        record, blobs = self.pack(data)
+        with self._lock, self._db:
+            self._delete(sid)
+            self._db.execute('INSERT INTO sessions VALUES (?, ?, ?)',
+                             (sid, encode_value(record), time.time() + self.ttl))
+            for h, text in blobs.items():
+                self._db.execute('INSERT OR IGNORE INTO blobs VALUES (?, ?)', (h, zlib.compress(text.encode())))
+                self._db.execute('INSERT INTO session_blobs VALUES (?, ?)', (sid, h))
+            self._nSaves += 1
+            if self._nSaves % self.purgeEvery == 0:
+                self._purge()
+
+    def delete(self, sid):
+        with self._lock, self._db:
+            self._delete(sid)
+
+    def get_blob(self, h):
+        with self._lock:
+            row = self._db.execute('SELECT data FROM blobs WHERE hash = ?', (h,)).fetchone()
+        return zlib.decompress(row[0]).decode() if row is not None else None
+
+    def _delete(self, sid):
+        self._db.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+        self._db.execute('DELETE FROM session_blobs WHERE sid = ?', (sid,))
+
+    def _purge(self):
+        self._db.execute('DELETE FROM session_blobs WHERE sid IN (SELECT sid FROM sessions WHERE expires < ?)',
+                         (time.time(),))
+        self._db.execute('DELETE FROM sessions WHERE expires < ?', (time.time(),))
+        self._db.execute('DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM session_blobs)')
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.load(sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if session.modified:
+            self.store.save(session.sid, dict(session))
+        if session.modified or session.new:
+            response.set_cookie(name, session.sid,
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app),
+                                domain=domain,
+                                path=path,
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
+
+def create_session_store(url, ttl=86400.):
+    if url.startswith('sqlite:///'):
+        return SqliteSessionStore(url[len('sqlite:///'):], ttl=ttl)
+    if url == 'memory':
+        return MemorySessionStore(ttl=ttl)
+    raise Exception(f"Unknown session store {url}. Use 'memory' or 'sqlite:///<path>'.")
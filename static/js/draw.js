@@ -8,7 +8,7 @@ document.addEventListener("DOMContentLoaded", function () {
             parameters: [
                 {label: "Flow Rate, lpm",       id: "FlowRate",     fallback: "0, 1"},
                 {label: "Pressure Head, kPa",   id: "PressureHead", fallback: "0, 0"},
-                {label: "Pump Speed, %",        id: "PumpSpeedPct", fallback: "100"}
+                {label: "Pump Speed, %",        id: "PumpSpeedPct", fallback: "100", range: [0, 100]}
             ],
             inlets: 1,
             outlets: 1
@@ -25,7 +25,7 @@ document.addEventListener("DOMContentLoaded", function () {
             parameters: [
                 {label: "Flow Rate, lpm",       id: "FlowRate",     fallback: "0, 0"},
                 {label: "Pressure Drop, kPa",   id: "PressureDrop", fallback: "0, 1"},
-                {label: "Valve Opening, %",     id: "ValveOpeningPct", fallback: "100"}
+                {label: "Valve Opening, %",     id: "ValveOpeningPct", fallback: "100", range: [0, 100]}
             ],
             inlets: 1,
             outlets: 1
@@ -95,6 +95,21 @@ document.addEventListener("DOMContentLoaded", function () {
     let componentCounter = 0;
     const components = {};
     const results = [];
+    const liveDelay = 250;
+    const live = {
+        enabled: false,
+        timer: null,
+        controller: null,
+        base: null,
+        version: 0,
+        seq: 0,
+        resultId: null,
+        ports: {}
+    };
+
+    jsPlumbInstance.bind("connection", () => scheduleLiveSolve());
+    jsPlumbInstance.bind("connectionDetached", () => scheduleLiveSolve());
+    jsPlumbInstance.bind("connectionMoved", () => scheduleLiveSolve());
 
     document.getElementById("addComponent").addEventListener("click", function () {
         const componentType = document.getElementById("componentType").value;
@@ -158,6 +173,7 @@ document.addEventListener("DOMContentLoaded", function () {
             paramDefaults[param.id] = param.fallback;
         });
         components[id] = { type: type, parameters: paramDefaults, connections: [] };
+        scheduleLiveSolve();
     }
 
     function editComponent(id, type) {
@@ -185,11 +201,31 @@ document.addEventListener("DOMContentLoaded", function () {
             const currentValue = components[id].parameters[param.id] || '';
             formHTML += `<label for='${param.id}'>${param.label}</label>`;
             formHTML += `<input style='min-width: 0;' type='text' id='${param.id}' value='${currentValue}'/>`;
+            if (param.range) {
+                formHTML += `<span></span><input style='min-width: 0;' type='range' id='${param.id}.range' `
+                formHTML += `min='${param.range[0]}' max='${param.range[1]}' value='${parseFloat(currentValue) || 0}'/>`;
+            }
         });
         formHTML += `</div><button id='${id}.saveParameters'>Save</button>`;
         editDiv.innerHTML = formHTML;
 
         component.appendChild(editDiv);
+        predefinedParams.forEach(param => {
+            const inputElement = document.getElementById(param.id);
+            const rangeElement = document.getElementById(`${param.id}.range`);
+            inputElement.addEventListener("input", function () {
+                if (rangeElement && !isNaN(parseFloat(inputElement.value))) {
+                    rangeElement.value = parseFloat(inputElement.value);
+                }
+                editParameter(id, param.id, inputElement.value);
+            });
+            if (rangeElement) {
+                rangeElement.addEventListener("input", function () {
+                    inputElement.value = rangeElement.value;
+                    editParameter(id, param.id, rangeElement.value);
+                });
+            }
+        });
         document.getElementById(`${id}.saveParameters`).addEventListener("click", function () {
             saveParameters(id, predefinedParams);
         });
@@ -203,7 +239,18 @@ document.addEventListener("DOMContentLoaded", function () {
             }
         });
         document.getElementById("editForm").remove();
-        removeOutletOverlays();
+        if (live.enabled) {
+            scheduleLiveSolve();
+        }
+        else {
+            removeOutletOverlays();
+        }
+    }
+
+    function editParameter(id, paramId, value) {
+        if (!live.enabled) return;
+        components[id].parameters[paramId] = value;
+        scheduleLiveSolve();
     }
 
     function delComponent(id) {
@@ -214,6 +261,7 @@ document.addEventListener("DOMContentLoaded", function () {
         jsPlumbInstance.remove(id);
         delete components[id];
         removeOutletOverlays();
+        scheduleLiveSolve();
     }
 
     document.getElementById("solve").addEventListener("click", function () {
@@ -254,6 +302,158 @@ document.addEventListener("DOMContentLoaded", function () {
         console.log(xml);
     });
 
+    document.getElementById("liveSolve").addEventListener("change", function () {
+        live.enabled = this.checked;
+        live.base = null;
+        live.resultId = null;
+        clearTimeout(live.timer);
+        if (live.controller) {
+            live.controller.abort();
+            live.controller = null;
+        }
+        if (live.enabled) {
+            scheduleLiveSolve(0);
+        }
+        else {
+            setLiveStatus('');
+            fetch("/solve/live", {method: "DELETE", headers: {"X-CSRFToken": getCSRFToken()}})
+            .catch(error => console.error('Error:', error));
+        }
+    });
+
+    function scheduleLiveSolve(delay = liveDelay) {
+        if (!live.enabled) return;
+        clearTimeout(live.timer);
+        live.timer = setTimeout(sendLiveSolve, delay);
+    }
+
+    function sendLiveSolve() {
+        updateConnections();
+        const snapshot = JSON.parse(JSON.stringify(components));
+        const request = {format: "numeric", delta: true, base: live.resultId};
+        if (live.base === null) {
+            live.version++;
+            request.diagram = snapshot;
+            request.version = live.version;
+        }
+        else {
+            const diff = diagramDiff(live.base, snapshot);
+            if (Object.keys(diff).length == 0) return;
+            request.diff = diff;
+            request.version = live.version++;
+        }
+        request.seq = ++live.seq;
+        live.base = snapshot;
+
+        if (live.controller) {
+            live.controller.abort();
+        }
+        const controller = new AbortController();
+        live.controller = controller;
+        setLiveStatus('Solving...');
+
+        fetch("/solve/live", {
+            method: "POST",
+            headers: {
+                "Content-Type": "application/json",
+                "X-CSRFToken": getCSRFToken(),
+            },
+            body: JSON.stringify(request),
+            signal: controller.signal
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.seq != live.seq || !live.enabled) return;
+            live.controller = null;
+            if (data.status == 'resync') {
+                live.base = null;
+                scheduleLiveSolve(0);
+                return;
+            }
+            displayLiveResults(data);
+        })
+        .catch(error => {
+            if (error.name == 'AbortError') return;
+            live.base = null;
+            live.resultId = null;
+            setLiveStatus('❌ Solver is not responding.');
+            console.error('Error:', error);
+        });
+    }
+
+    function diagramDiff(base, current) {
+        const diff = {};
+        const remove = Object.keys(base).filter(id => !(id in current));
+        const add = {};
+        const parameters = {};
+        const connect = [];
+        const disconnect = [];
+        const linkKey = conn => `${conn.from}>${conn.to}`;
+        for (let id in current) {
+            const comp = current[id];
+            if (!(id in base)) {
+                add[id] = comp;
+                continue;
+            }
+            const changed = {};
+            for (let key in comp.parameters) {
+                if (comp.parameters[key] !== base[id].parameters[key]) {
+                    changed[key] = comp.parameters[key];
+                }
+            }
+            if (Object.keys(changed).length > 0) {
+                parameters[id] = changed;
+            }
+            const before = new Set(base[id].connections.map(linkKey));
+            const after = new Set(comp.connections.map(linkKey));
+            base[id].connections.forEach(conn => { if (!after.has(linkKey(conn))) disconnect.push(conn); });
+            comp.connections.forEach(conn => { if (!before.has(linkKey(conn))) connect.push(conn); });
+        }
+        if (disconnect.length > 0) diff.disconnect = disconnect;
+        if (remove.length > 0) diff.remove = remove;
+        if (Object.keys(add).length > 0) diff.add = add;
+        if (connect.length > 0) diff.connect = connect;
+        if (Object.keys(parameters).length > 0) diff.parameters = parameters;
+        return diff;
+    }
+
+    function displayLiveResults(data) {
+        if (data.status == 'superseded') return;
+        if (data.status != 'success' && data.status != 'marginal') {
+            live.base = null;
+            live.resultId = null;
+            setLiveStatus('❌ ' + data.message);
+            removeOutletOverlays();
+            return;
+        }
+        const result = data.result;
+        live.resultId = result.resultId;
+        if (!result.delta) {
+            live.ports = {};
+        }
+        result.removed?.ports?.forEach(portId => delete live.ports[portId]);
+        result.ports.ids.forEach((portId, i) => { live.ports[portId] = [result.ports.Q[i], result.ports.P[i]]; });
+
+        const text = {};
+        for (let portId in live.ports) {
+            if (!portId.includes('.Outlet')) continue;
+            const [q, p] = live.ports[portId];
+            text[portId] = `Q=${q.toFixed(2)}, P=${p.toFixed(2)}`;
+        }
+        removeOutletOverlays();
+        addOutletOverlays(text);
+        if (data.status == 'success') {
+            setLiveStatus(`✅ ${(data.metrics.solveTime * 1000).toFixed(0)} ms`);
+        }
+        else {
+            setLiveStatus('⚠️ Solution Not Converged!');
+        }
+    }
+
+    function setLiveStatus(message) {
+        document.getElementById("liveStatus").innerText = message;
+    }
+
     function updateConnections() {
         const connections = jsPlumbInstance.getAllConnections();
         console.log(connections)
@@ -0,0 +1,42 @@
+from benchmarks.networks import generate, networkTypes
+from hydraulics.diagram_handler import build_assembly, solve_assembly
+import numpy as np
+import pytest
+
+def perturbed_assembly(networkType, n=60, seed=0):
+    assy = build_assembly(generate(networkType, n))
+    solve_assembly(assy)
+    if assy.compiled is None:
+        assy.compile()
+    x = np.asarray(assy.get_init_values(), dtype=float)
+    rng = np.random.default_rng(seed)
+    return assy, x * (1 + 0.1 * rng.standard_normal(len(x)))
+
+@pytest.mark.parametrize('networkType', list(networkTypes))
+def test_compiled_balance_matches_reference(networkType):
+    assy, x = perturbed_assembly(networkType)
+    compiled = assy.compiled
+    assert compiled.eqBlockIds == [uid for uid, b in assy.blocks.items() if b.qp_balance() is not None]
+    y = compiled.qp_balance(x)
+    yRef = np.asarray(assy.qp_balance_ref(x), dtype=float)
+    np.testing.assert_allclose(y, yRef, rtol=1e-12, atol=1e-10)
+
+@pytest.mark.parametrize('networkType', list(networkTypes))
+def test_compiled_jacobian_matches_reference(networkType):
+    assy, x = perturbed_assembly(networkType)
+    jac = assy.compiled.qp_jacobian(x).toarray()
+    jacRef = assy.qp_jacobian_ref(x).toarray()
+    np.testing.assert_allclose(jac, jacRef, rtol=1e-12, atol=1e-12)
+
+@pytest.mark.parametrize('networkType', list(networkTypes))
+def test_compiled_jacobian_matches_finite_differences(networkType):
+    assy, x = perturbed_assembly(networkType)
+    compiled = assy.compiled
+    jac = compiled.qp_jacobian(x).toarray()
+    fd = np.empty_like(jac)
+    for j in range(len(x)):
+        h = 1e-7 * max(1., abs(x[j]))
+        e = np.zeros(len(x))
+        e[j] = h
+        fd[:, j] = (compiled.qp_balance(x + e) - compiled.qp_balance(x - e)) / (2 * h)
+    np.testing.assert_allclose(fd, jac, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,104 @@
+from benchmarks.networks import generate
+from hydraulics.diagram_handler import run_solver
+from hydraulics.live import LiveDiagram
+import copy
+import pytest
+
+def port_values(result):
+    ports = result['ports']
+    return dict(zip(ports['ids'], zip(ports['Q'], ports['P'])))
+
+def assert_matches_fresh_solve(live, expected):
+    status, result, metrics = live.solve('numeric')
+    assert status == 'success'
+    freshStatus, message, fresh, freshMetrics = run_solver(copy.deepcopy(expected), resultFormat='numeric')
+    assert freshStatus == 'success', message
+    actual, fresh = port_values(result), port_values(fresh)
+    assert actual.keys() == fresh.keys()
+    for port, values in fresh.items():
+        assert actual[port] == pytest.approx(values, rel=1e-4, abs=1e-4), port
+
+def connect(diagram, src, dst):
+    diagram[src.rpartition('.')[0]]['connections'].append({'from': src, 'to': dst})
+
+def disconnect(diagram, src, dst):
+    conns = diagram[src.rpartition('.')[0]]['connections']
+    conns[:] = [c for c in conns if (c['from'], c['to']) != (src, dst)]
+
+@pytest.fixture
+def mesh():
+    diagram = generate('mesh', 30)
+    live = LiveDiagram(diagram)
+    live.solve()
+    return live, copy.deepcopy(diagram)
+
+def test_parameter_change(mesh):
+    live, expected = mesh
+    params = {'PumpIn': {'PumpSpeedPct': '70'},
+              'Rung1': {'InnerDiameter': '0.02'},
+              'ReservoirIn': {'PressureConst': '110'}}
+    live.apply({'parameters': params})
+    for uid, values in params.items():
+        expected[uid]['parameters'].update(values)
+    assert_matches_fresh_solve(live, expected)
+
+def test_replace_block(mesh):
+    live, expected = mesh
+    params = {'PumpIn': {'FlowRate': '0, 20, 40, 60', 'PressureHead': '320, 280, 200, 0'},
+              'RungResistance2': {'PressureDrop': '0, 80'}}
+    live.apply({'parameters': params})
+    for uid, values in params.items():
+        expected[uid]['parameters'].update(values)
+    assert_matches_fresh_solve(live, expected)
+
+def test_remove_and_add(mesh):
+    live, expected = mesh
+    resistance = {'type': 'Resistance', 'parameters': {'FlowRate': '0, 20', 'PressureDrop': '0, 25'},
+                  'connections': [{'from': 'NewResistance.Outlet1', 'to': 'RungResistance2.Inlet1'}]}
+    live.apply({'remove': ['Rung2'],
+                'add': {'NewResistance': copy.deepcopy(resistance)},
+                'connect': [{'from': 'TopSplitter2.Outlet2', 'to': 'NewResistance.Inlet1'}]})
+    del expected['Rung2']
+    disconnect(expected, 'TopSplitter2.Outlet2', 'Rung2.Inlet1')
+    expected['NewResistance'] = resistance
+    connect(expected, 'TopSplitter2.Outlet2', 'NewResistance.Inlet1')
+    assert_matches_fresh_solve(live, expected)
+
+def test_disconnect_and_reconnect(mesh):
+    live, expected = mesh
+    link = {'from': 'TopRail1.Outlet1', 'to': 'TopSplitter1.Inlet1'}
+    live.apply({'disconnect': [link]})
+    live.apply({'connect': [link]})
+    assert_matches_fresh_solve(live, expected)
+
+    pipe = {'type': 'Pipe', 'parameters': {'InnerDiameter': '0.04', 'PipeLength': '15'},
+            'connections': [{'from': 'NewPipe.Outlet1', 'to': 'TopSplitter1.Inlet1'}]}
+    live.apply({'disconnect': [link],
+                'add': {'NewPipe': copy.deepcopy(pipe)},
+                'connect': [{'from': 'TopRail1.Outlet1', 'to': 'NewPipe.Inlet1'}]})
+    disconnect(expected, link['from'], link['to'])
+    expected['NewPipe'] = pipe
+    connect(expected, 'TopRail1.Outlet1', 'NewPipe.Inlet1')
+    assert_matches_fresh_solve(live, expected)
+
+def test_dotted_block_ids():
+    diagram = generate('chain', 14)
+    diagram['Pipe.A'] = diagram.pop('Pipe4')
+    for comp in diagram.values():
+        for conn in comp['connections']:
+            conn['from'] = conn['from'].replace('Pipe4.', 'Pipe.A.')
+            conn['to'] = conn['to'].replace('Pipe4.', 'Pipe.A.')
+    live = LiveDiagram(diagram)
+    live.solve()
+    expected = copy.deepcopy(diagram)
+    live.apply({'remove': ['Pipe.A'],
+                'add': {'Pipe.B': {'type': 'Pipe', 'parameters': {'InnerDiameter': '0.04', 'PipeLength': '8'},
+                                   'connections': [{'from': 'Pipe.B.Outlet1', 'to': 'Pipe5.Inlet1'}]}},
+                'connect': [{'from': 'Valve3.Outlet1', 'to': 'Pipe.B.Inlet1'}]})
+    del expected['Pipe.A']
+    disconnect(expected, 'Valve3.Outlet1', 'Pipe.A.Inlet1')
+    expected['Pipe.B'] = {'type': 'Pipe', 'parameters': {'InnerDiameter': '0.04', 'PipeLength': '8'},
+                          'connections': [{'from': 'Pipe.B.Outlet1', 'to': 'Pipe5.Inlet1'}]}
+    connect(expected, 'Valve3.Outlet1', 'Pipe.B.Inlet1')
+    assert live.diagramData['Valve3']['connections'] == expected['Valve3']['connections']
+    assert_matches_fresh_solve(live, expected)
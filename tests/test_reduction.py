@@ -0,0 +1,54 @@
+from benchmarks.networks import generate
+from hydraulics.diagram_handler import build_assembly, solve_assembly
+import numpy as np
+import pytest
+
+def pipe(uid, length, dst):
+    return {'type': 'Pipe', 'parameters': {'InnerDiameter': '0.03', 'PipeLength': length},
+            'connections': [{'from': uid + '.Outlet1', 'to': dst}]}
+
+def parallel_branches(pOut='120', speed='100'):
+    return {'In': {'type': 'Reservoir', 'parameters': {'PressureConst': '100'},
+                   'connections': [{'from': 'In.Outlet1', 'to': 'Pump.Inlet1'}]},
+            'Pump': {'type': 'Pump',
+                     'parameters': {'FlowRate': '0, 50, 100', 'PressureHead': '280, 224, 0', 'PumpSpeedPct': speed},
+                     'connections': [{'from': 'Pump.Outlet1', 'to': 'Split.Inlet1'}]},
+            'Split': {'type': 'Splitter', 'parameters': {},
+                      'connections': [{'from': 'Split.Outlet1', 'to': 'A1.Inlet1'},
+                                      {'from': 'Split.Outlet2', 'to': 'B1.Inlet1'}]},
+            'A1': pipe('A1', '10', 'A2.Inlet1'),
+            'A2': {'type': 'Resistance', 'parameters': {'FlowRate': '0, 100', 'PressureDrop': '0, 30'},
+                   'connections': [{'from': 'A2.Outlet1', 'to': 'Mix.Inlet1'}]},
+            'B1': pipe('B1', '20', 'B2.Inlet1'),
+            'B2': pipe('B2', '5', 'Mix.Inlet2'),
+            'Mix': {'type': 'Mixer', 'parameters': {},
+                    'connections': [{'from': 'Mix.Outlet1', 'to': 'Out.Inlet1'}]},
+            'Out': {'type': 'Reservoir', 'parameters': {'PressureConst': pOut}, 'connections': []}}
+
+def reversed_chain():
+    diagram = generate('chain', 14)
+    diagram['Pump1']['parameters']['PumpSpeedPct'] = '0'
+    diagram['Reservoir13']['parameters']['PressureConst'] = '400'
+    return diagram
+
+cases = {'series': (lambda: generate('chain', 30), False),
+         'mesh': (lambda: generate('mesh', 30), True),
+         'parallel': (parallel_branches, False),
+         'parallel reversed': (lambda: parallel_branches('300', '0'), True),
+         'series reversed': (reversed_chain, True)}
+
+def solved_values(diagramData, reduce):
+    assy = build_assembly(diagramData)
+    assert solve_assembly(assy, reduce=reduce)
+    return assy, np.array(assy.store.value)
+
+@pytest.mark.parametrize('name', list(cases))
+def test_reduced_solve_matches_full_solve(name):
+    make, reverses = cases[name]
+    full, expected = solved_values(make(), False)
+    reduced, actual = solved_values(make(), True)
+    assert reduced.solveInfo['method'] == 'reduced'
+    assert reduced.solveInfo['reducedStates'] < reduced.nStates
+    np.testing.assert_allclose(actual, expected, rtol=1e-6, atol=1e-6)
+    q = [block.states[0].value for block in full.blocks.values() if block.states]
+    assert (min(q) < 0) == reverses
@@ -0,0 +1,37 @@
+from benchmarks.networks import generate
+from hydraulics.diagram_handler import run_solver
+from hydraulics.sweep import run_sweep
+import copy
+import re
+import pytest
+
+points = [{'Pump1.PumpSpeedPct': 50},
+          {'Valve3.ValveOpeningPct': 30},
+          {'Pump1.PumpSpeedPct': 90, 'Valve9.ValveOpeningPct': 60},
+          {'Valve9.ValveOpeningPct': 40}]
+
+def port_values(result):
+    return {port: [float(v) for v in re.findall(r'=(-?[\d.]+)', text)] for port, text in result.items()}
+
+def direct_solve(diagramData, params):
+    diagramData = copy.deepcopy(diagramData)
+    for key, value in params.items():
+        uid, _, name = key.rpartition('.')
+        diagramData[uid]['parameters'][name] = str(value)
+    status, message, result, metrics = run_solver(diagramData)
+    assert status == 'success', message
+    return port_values(result)
+
+@pytest.mark.parametrize('workers, chunkSize', [(1, None), (2, 1)])
+def test_sweep_points_match_direct_solves(workers, chunkSize):
+    diagramData = generate('chain', 30)
+    results = sorted(run_sweep(diagramData, points=points, workers=workers, chunkSize=chunkSize),
+                     key=lambda r: r['index'])
+    assert [r['index'] for r in results] == list(range(len(points)))
+    for res, params in zip(results, points):
+        assert res['status'] == 'success', res['message']
+        expected = direct_solve(diagramData, params)
+        actual = port_values(res['result'])
+        assert actual.keys() == expected.keys()
+        for port in expected:
+            assert actual[port] == pytest.approx(expected[port], abs=0.011), port